@@ -0,0 +1,134 @@
+"""
+Packing and table driven decoding of Huffman codes, used by problem_3.py.
+
+They are kept in this module, so that the worker processes of
+huffman_compress_parallel can import them with every start method of
+multiprocessing.
+
+A code table is a hash map that maps every letter to its code as an
+integer and the number of bits of the code. Bytes are encoded as the
+letters with the same code point (latin-1).
+"""
+
+
+def pack_codes(data, codes):
+    """
+    Packs the codes of the letters of data into bytes, the first bit of
+    the code is the highest bit of the first byte. Returns the packed
+    bytes and their number of bits.
+    """
+    out = bytearray()
+    acc = 0
+    n_bits = 0
+    bit_length = 0
+    for ch in data:
+        code, length = codes[ch]
+        acc = (acc << length) | code
+        n_bits += length
+        bit_length += length
+        while n_bits >= 8:
+            n_bits -= 8
+            out.append(acc >> n_bits)
+            acc &= (1 << n_bits) - 1
+    if n_bits:
+        # Pad the last byte with zeros
+        out.append(acc << (8 - n_bits))
+    return bytes(out), bit_length
+
+
+class TableDecoder:
+    def __init__(self, codes):
+        """
+        Decoder for a code table that looks up a whole byte at once.
+        """
+        assert(all(length > 0 for _, length in codes.values())), "Every code needs at least one bit"
+        # A state is the code read so far, with a leading 1 bit so that
+        # codes of different lengths differ. self.letters maps every
+        # complete code to its letter.
+        self.letters = {(1 << length) | code: letter
+                        for letter, (code, length) in codes.items()}
+        # The states are numbered in the order they are reached, the
+        # empty code 1 gets number 0
+        self.states = [1]
+        self.numbers = {1: 0}
+        # self.tables holds the table of every state once it is built
+        self.tables = [None]
+
+    def get_table(self, number):
+        """
+        Returns the lookup table for the state with the number, and builds
+        it on first use.
+
+        Every entry is a tuple of the decoded letters and the number of
+        the state where the 8 bits end.
+        """
+        table = self.tables[number]
+        if table is not None:
+            return table
+        table = []
+        for byte in range(256):
+            letters = ""
+            current = self.states[number]
+            for shift in range(7, -1, -1):
+                current = (current << 1) | ((byte >> shift) & 1)
+                letter = self.letters.get(current)
+                if letter is not None:
+                    letters += letter
+                    current = 1
+            if current not in self.numbers:
+                self.numbers[current] = len(self.states)
+                self.states.append(current)
+                self.tables.append(None)
+            table.append((letters, self.numbers[current]))
+        self.tables[number] = table
+        return table
+
+    def decode(self, data, bit_length):
+        """
+        Decodes the first bit_length bits of the bytes data and returns
+        the decoded letters as a string.
+        """
+        if not bit_length:
+            return ""
+        tables = self.tables
+        get_table = self.get_table
+        letters = []
+        append = letters.append
+        number = 0
+        table = get_table(0)
+        last = (bit_length - 1) // 8
+        for byte in memoryview(data)[:last]:
+            found, number = table[byte]
+            if found:
+                append(found)
+            table = tables[number] or get_table(number)
+        # The last byte may be padded, decode its valid bits one by one
+        state = self.states[number]
+        byte = data[last]
+        for shift in range(7, 7 - (bit_length - 8 * last), -1):
+            state = (state << 1) | ((byte >> shift) & 1)
+            letter = self.letters.get(state)
+            if letter is not None:
+                append(letter)
+                state = 1
+        return "".join(letters)
+
+
+def encode_block(block, codes):
+    """
+    Packs a block of bytes. Returns the packed bytes and their number of
+    bits.
+    """
+    # Look the codes up by byte value, without decoding the block
+    byteCodes = [None] * 256
+    for letter, code in codes.items():
+        byteCodes[ord(letter)] = code
+    return pack_codes(block, byteCodes)
+
+
+def decode_block(payload, bit_length, codes):
+    """
+    Decodes bit_length bits of payload, which was packed by encode_block
+    with the same codes. Returns the decoded bytes.
+    """
+    return TableDecoder(codes).decode(payload, bit_length).encode("latin-1")
@@ -48,6 +48,13 @@ class Node():
 
 
 #%%
+import os
+import pickle
+import time
+
+# Default value of update_node_to_mru(), so that None can be stored
+_NO_VALUE = object()
+
 class DoublyLinkedList():
     
     def __init__(self):
@@ -71,17 +78,33 @@ class DoublyLinkedList():
             self.head = node
         return node
     
-    def update_node_to_mru(self, node, value=None):
+    def append(self, key, value):
         """
-        Updates the node position to be the most recently used (mru) node.
+        Creates a new node and appends it to the end of the list.
         """
-        if value:
+        node = Node(key, value)
+        if not self.tail:
+            self.head = node
+            self.tail = node
+        else:
+            node.prev = self.tail
+            self.tail.next = node
+            self.tail = node
+        return node
+    
+    def update_node_to_mru(self, node, value=_NO_VALUE):
+        """
+        Updates the node position to be the most recently used (mru) node,
+        and its value if one is given.
+        """
+        if value is not _NO_VALUE:
             node.set_data(value)
         if node is not self.head:            
             prevNode = node.prev
             nextNode = node.next
             # Move node to the front of the list
             node.next = self.head
+            node.prev = None
             self.head.prev = node
             self.head = node
             # Fix the "gap" I've created by moving the node to the front
@@ -98,9 +121,58 @@ class DoublyLinkedList():
         """
         key, value = self.tail.get_data()
         self.tail = self.tail.prev
-        self.tail.next = None
+        if self.tail:
+            self.tail.next = None
+        else:
+            # The list only had one node
+            self.head = None
         
         return key, value
+    
+    def remove(self, node):
+        """
+        Removes the node from anywhere in the list.
+        """
+        prevNode = node.prev
+        nextNode = node.next
+        if prevNode:
+            prevNode.next = nextNode
+        else:
+            self.head = nextNode
+        if nextNode:
+            nextNode.prev = prevNode
+        else:
+            self.tail = prevNode
+        return node.get_data()
+    
+    def iter_from_head(self):
+        """
+        Yields the (key, node) pairs from the most to the least recently
+        used node.
+        """
+        node = self.head
+        while node:
+            yield node.key, node
+            node = node.next
+    
+    def iter_from_tail(self, node=None):
+        """
+        Yields the (key, node) pairs from the least to the most recently
+        used node, or from the given node on. The yielded node may be
+        removed while iterating.
+        """
+        if node is None:
+            node = self.tail
+        while node:
+            prevNode = node.prev
+            yield node.key, node
+            node = prevNode
+    
+    def get_value(self, node):
+        """
+        Returns the value stored in the node.
+        """
+        return node.value
         
     def __str__(self):
         """
@@ -116,36 +188,85 @@ class DoublyLinkedList():
 
 class LRU_Cache(object):
 
-    def __init__(self, capacity):
+    def __init__(self, capacity, storage="linked", default_ttl=None,
+                 reap_steps=0, clock=time.monotonic, weigher=None):
         """
         Least recently used (LRU) cache with a fixed capacity.
+        
+        storage selects how the recency order is kept: "linked" uses a
+        DoublyLinkedList of Node objects, "array" uses an ArrayLinkedList
+        with preallocated slots.
+        
+        default_ttl is the time to live in seconds for items that are set
+        without their own ttl. None means that items never expire.
+        Each set() checks up to reap_steps items for expiry, continuing
+        where the last reap stopped.
+        
+        If weigher is given, capacity is the maximum total weight of all
+        items instead of their number, and weigher(value) returns the
+        weight of a value, e.g. len or sys.getsizeof.
         """
         assert(type(capacity) == int), "Capacity has to be an integer"
         assert(capacity > 0), "Capacity has to be larger than 0"
+        assert(storage in ("linked", "array")), "Storage has to be 'linked' or 'array'"
+        assert(default_ttl is None or default_ttl > 0), "TTL has to be larger than 0"
+        assert(weigher is None or storage == "linked"), "Weighted capacity requires linked storage"
         # Initialize class variables
-        # self.cache maps the key to the respective node
+        # self.cache maps the key to the respective node (or slot)
         self.cache = {}
-        self.ll = DoublyLinkedList()
+        if storage == "array":
+            self.ll = ArrayLinkedList(capacity)
+        else:
+            self.ll = DoublyLinkedList()
         self.capacity = capacity
+        # self.expires maps the key to its expiry time, only for keys
+        # that have a ttl
+        self.expires = {}
+        self.default_ttl = default_ttl
+        self.reap_steps = reap_steps
+        # The key where the next reap() continues, the end of the list
+        # if it is not in the cache anymore
+        self.reap_key = _NO_KEY
+        self.clock = clock
+        # self.weights maps the key to the weight of its value, only
+        # if the cache has a weigher
+        self.weigher = weigher
+        self.weights = {}
+        self.total_weight = 0
+        # Number of items removed so far to make room for new ones
+        self.evicted = 0
+        # CacheStats while enable_stats() is active, None otherwise
+        self.stats = None
 
-    def get(self, key):
+    def get(self, key, default=-1):
         """
         Retrieves the item with the provided key. 
-        Returns -1 if nonexistent.
+        Returns default (-1) if nonexistent or expired.
         """
         if key in self.cache:
+            if self.expires and self._is_expired(key, self.clock()):
+                self._remove(key)
+                return default
             self.ll.update_node_to_mru(self.cache[key])
-            return self.cache[key].get_data()[1]
+            return self.ll.get_value(self.cache[key])
         else:
-            return -1
+            return default
 
-    def set(self, key, value):
+    def set(self, key, value, ttl=None):
         """
         Sets the value if the key is not present in the cache.
         
         If the cache is at capacity, it removes the oldest item before
         inserting the new item.
+        
+        The item expires after ttl seconds, or after default_ttl seconds
+        if ttl is None.
+        
+        Returns False if the item is heavier than the capacity and was
+        not stored, True otherwise.
         """
+        if self.weigher is not None:
+            return self._set_weighted(key, value, ttl)
         if key in self.cache:
             self.ll.update_node_to_mru(self.cache[key], value)
         elif len(self.cache) < self.capacity:
@@ -154,15 +275,1225 @@ class LRU_Cache(object):
         else:
             removedKey, _ = self.ll.remove_lru()
             self.cache.pop(removedKey)
+            self.expires.pop(removedKey, None)
+            self.evicted += 1
             node = self.ll.prepend(key, value)
             self.cache[key] = node
-            
+        self._set_expiry(key, ttl)
+        if self.reap_steps:
+            self.reap(self.reap_steps)
+        return True
+
+    def _set_weighted(self, key, value, ttl):
+        """
+        Sets the value and removes the least recently used items until
+        the total weight fits into the capacity again.
+        """
+        weight = self.weigher(value)
+        if weight > self.capacity:
+            # Don't keep the old value around for the rejected one
+            if key in self.cache:
+                self._remove(key)
+            return False
+        if key in self.cache:
+            self.ll.update_node_to_mru(self.cache[key], value)
+            self.total_weight -= self.weights[key]
+        else:
+            self.cache[key] = self.ll.prepend(key, value)
+        self.weights[key] = weight
+        self.total_weight += weight
+        # The new item is at the front of the list and fits into the
+        # capacity on its own, so it is never removed here
+        while self.total_weight > self.capacity:
+            removedKey, _ = self.ll.remove_lru()
+            self.cache.pop(removedKey)
+            self.expires.pop(removedKey, None)
+            self.total_weight -= self.weights.pop(removedKey)
+            self.evicted += 1
+        self._set_expiry(key, ttl)
+        if self.reap_steps:
+            self.reap(self.reap_steps)
+        return True
+
+    def _set_expiry(self, key, ttl):
+        """
+        Stores the expiry time of the key, or forgets it if the key
+        doesn't expire.
+        """
+        if ttl is None:
+            ttl = self.default_ttl
+        if ttl is not None:
+            self.expires[key] = self.clock() + ttl
+        elif self.expires:
+            self.expires.pop(key, None)
+
+    def _is_expired(self, key, now):
+        """
+        Returns True if the key has an expiry time that has passed.
+        """
+        expiry = self.expires.get(key)
+        return expiry is not None and expiry <= now
+
+    def _remove(self, key):
+        """
+        Removes the key from the hash map and the linked list.
+        """
+        self.ll.remove(self.cache.pop(key))
+        self.expires.pop(key, None)
+        self.total_weight -= self.weights.pop(key, 0)
+
+    def reap(self, max_steps):
+        """
+        Walks at most max_steps items towards the most recently used end
+        of the list and removes the expired ones. Every call continues
+        where the last one stopped, and starts at the least recently used
+        end again after reaching the other one. This way, items that
+        don't expire can't keep the reaper from getting past them.
+        
+        Returns the number of removed items.
+        """
+        if not self.expires:
+            return 0
+        now = self.clock()
+        removed = 0
+        # Don't visit any item twice in one call
+        steps = min(max_steps, len(self.cache))
+        start = self.cache.get(self.reap_key)
+        while steps > 0:
+            for key, node in self.ll.iter_from_tail(start):
+                if steps == 0:
+                    self.reap_key = key
+                    break
+                steps -= 1
+                if self._is_expired(key, now):
+                    self._remove(key)
+                    removed += 1
+            else:
+                # Reached the most recently used item
+                self.reap_key = _NO_KEY
+            start = None
+        return removed
+
+    def get_many(self, keys):
+        """
+        Retrieves the items with the provided keys in one pass.
+
+        Returns a dict with the found keys and their values, and a list of
+        the keys that are not in the cache. The recency order afterwards
+        is the same as after calling get() for each key in turn.
+        """
+        # Bind lookups to local names to avoid the attribute and method
+        # call overhead of get() for every key
+        cache = self.cache
+        update_node_to_mru = self.ll.update_node_to_mru
+        get_value = self.ll.get_value
+        expires = self.expires
+        now = self.clock() if expires else None
+        hits = {}
+        misses = []
+        for key in keys:
+            node = cache.get(key)
+            if node is None:
+                misses.append(key)
+            elif expires and self._is_expired(key, now):
+                self._remove(key)
+                misses.append(key)
+            else:
+                update_node_to_mru(node)
+                hits[key] = get_value(node)
+        return hits, misses
+
+    def set_many(self, items):
+        """
+        Sets all (key, value) pairs in items, or all items of a dict,
+        in one pass. The cache ends up in the same state as after calling
+        set() for each pair in turn. All items get the default_ttl.
+        
+        Returns the number of inserted, updated and rejected items.
+        """
+        if isinstance(items, dict):
+            items = items.items()
+        inserted = 0
+        updated = 0
+        if self.weigher is not None:
+            rejected = 0
+            for key, value in items:
+                exists = key in self.cache
+                if not self._set_weighted(key, value, None):
+                    rejected += 1
+                elif exists:
+                    updated += 1
+                else:
+                    inserted += 1
+            return inserted, updated, rejected
+        cache = self.cache
+        ll = self.ll
+        capacity = self.capacity
+        expires = self.expires
+        ttl = self.default_ttl
+        expiry = self.clock() + ttl if ttl is not None else None
+        evicted = 0
+        for key, value in items:
+            node = cache.get(key)
+            if node is not None:
+                ll.update_node_to_mru(node, value)
+                updated += 1
+            else:
+                if len(cache) >= capacity:
+                    removedKey, _ = ll.remove_lru()
+                    del cache[removedKey]
+                    expires.pop(removedKey, None)
+                    evicted += 1
+                cache[key] = ll.prepend(key, value)
+                inserted += 1
+            if expiry is not None:
+                expires[key] = expiry
+            elif expires:
+                expires.pop(key, None)
+        self.evicted += evicted
+        if self.reap_steps:
+            self.reap(self.reap_steps)
+        return inserted, updated, 0
+
+    def pop_lru(self):
+        """
+        Removes the least recently used item and returns its key and value.
+        """
+        key, value = self.ll.remove_lru()
+        self.cache.pop(key)
+        self.expires.pop(key, None)
+        self.total_weight -= self.weights.pop(key, 0)
+        return key, value
+
+    def enable_stats(self):
+        """
+        Starts counting hits, misses, inserts, updates and evictions, and
+        measuring the latency of every operation. Returns the CacheStats.
+        
+        The instrumented methods are set on this instance only, so a cache
+        without stats runs the plain methods without any overhead.
+        """
+        self.stats = CacheStats()
+        instrument_cache(self, self.stats)
+        return self.stats
+
+    def disable_stats(self):
+        """
+        Stops collecting statistics and removes the instrumented methods.
+        """
+        for name in ("get", "set", "get_many", "set_many"):
+            self.__dict__.pop(name, None)
+        self.stats = None
+
+    def save_snapshot(self, path):
+        """
+        Writes all items to a binary file, from the most to the least
+        recently used one. Every item is pickled on its own, so no copy
+        of the whole cache is built in memory.
+        
+        The file is written next to path first and then renamed, so an
+        existing snapshot is never left half written.
+        """
+        now = self.clock()
+        tmpPath = path + ".tmp"
+        with open(tmpPath, "wb") as f:
+            f.write(SNAPSHOT_MAGIC)
+            for key, node in self.ll.iter_from_head():
+                # Store the remaining time to live, since the clock of
+                # the next process starts somewhere else
+                expiry = self.expires.get(key)
+                ttl = expiry - now if expiry is not None else None
+                pickle.dump((key, self.ll.get_value(node), ttl), f,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpPath, path)
+
+    def load_snapshot(self, path):
+        """
+        Loads the items of a snapshot into the empty cache, one at a time,
+        and keeps their recency order. Expired items and items that don't
+        fit into the capacity anymore are skipped.
+        
+        Returns the number of loaded items.
+        """
+        assert(len(self.cache) == 0), "A snapshot can only be loaded into an empty cache"
+        now = self.clock()
+        with open(path, "rb") as f:
+            if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                raise ValueError("Not a LRU_Cache snapshot: " + path)
+            while self.weigher is not None or len(self.cache) < self.capacity:
+                try:
+                    key, value, ttl = pickle.load(f)
+                except EOFError:
+                    break
+                if ttl is not None:
+                    if ttl <= 0:
+                        continue
+                    self.expires[key] = now + ttl
+                if self.weigher is not None:
+                    weight = self.weigher(value)
+                    if self.total_weight + weight > self.capacity:
+                        self.expires.pop(key, None)
+                        continue
+                    self.weights[key] = weight
+                    self.total_weight += weight
+                # The snapshot starts with the most recently used item,
+                # so every following item goes to the end of the list
+                self.cache[key] = self.ll.append(key, value)
+        return len(self.cache)
+
     def __str__(self):
         """
         String representation of the cache
         """
         return str(self.ll)
 
+# Marks the start of a file written by LRU_Cache.save_snapshot()
+SNAPSHOT_MAGIC = b"LRUSNAP1"
+# Never used as a key, so reap() starts at the end of the list
+_NO_KEY = object()
+
+#%% [markdown]
+# ### Array backed linked list
+# Every `Node` is a full Python object with its own attribute dict. For caches with millions of entries, this overhead dominates the memory usage. `ArrayLinkedList` stores keys, values and the prev/next links in four preallocated arrays of length `capacity`. A node is just the index of its slot. The links are kept in typed arrays (`array("q")`), so they don't need a Python object per entry. The slot freed by `remove_lru()` is chained into a free list through the `next` array and reused by the next `prepend()`, so no slots are allocated once the cache is full.
+# 
+# Use it with `LRU_Cache(capacity, storage="array")`. The interface is the same as the one of `DoublyLinkedList`.
+
+#%%
+from array import array
+import tracemalloc
+
+class ArrayLinkedList():
+    
+    def __init__(self, capacity):
+        """
+        Doubly linked list with a fixed number of slots. Nodes are
+        identified by their slot index, -1 marks a missing link.
+        """
+        self.keys = [None] * capacity
+        self.values = [None] * capacity
+        self.prev = array("q", [-1]) * capacity
+        # The free slots are chained through self.next as well, starting
+        # at self.free_head, so they don't need a list of Python ints
+        self.next = array("q", range(1, capacity)) + array("q", [-1])
+        self.free_head = 0
+        self.head = -1
+        self.tail = -1
+        
+    def prepend(self, key, value):
+        """
+        Stores the key and value in a free slot and prepends it to the
+        front of the list. Returns the slot index.
+        """
+        slot = self.free_head
+        self.free_head = self.next[slot]
+        self.keys[slot] = key
+        self.values[slot] = value
+        self.prev[slot] = -1
+        self.next[slot] = self.head
+        if self.head == -1:
+            self.tail = slot
+        else:
+            self.prev[self.head] = slot
+        self.head = slot
+        return slot
+    
+    def append(self, key, value):
+        """
+        Stores the key and value in a free slot and appends it to the
+        end of the list. Returns the slot index.
+        """
+        slot = self.free_head
+        self.free_head = self.next[slot]
+        self.keys[slot] = key
+        self.values[slot] = value
+        self.prev[slot] = self.tail
+        self.next[slot] = -1
+        if self.tail == -1:
+            self.head = slot
+        else:
+            self.next[self.tail] = slot
+        self.tail = slot
+        return slot
+    
+    def update_node_to_mru(self, slot, value=_NO_VALUE):
+        """
+        Updates the slot position to be the most recently used (mru) slot,
+        and its value if one is given.
+        """
+        if value is not _NO_VALUE:
+            self.values[slot] = value
+        if slot != self.head:
+            prevSlot = self.prev[slot]
+            nextSlot = self.next[slot]
+            # Move slot to the front of the list
+            self.next[slot] = self.head
+            self.prev[self.head] = slot
+            self.prev[slot] = -1
+            self.head = slot
+            # Fix the "gap" I've created by moving the slot to the front
+            self.next[prevSlot] = nextSlot
+            if nextSlot != -1:
+                self.prev[nextSlot] = prevSlot
+            else:
+                self.tail = prevSlot
+                
+    def remove_lru(self):
+        """
+        Remove the least recently used (lru) slot, which is located
+        at the end of the list, and mark it as free.
+        """
+        slot = self.tail
+        key, value = self.keys[slot], self.values[slot]
+        # Drop the references so the key and value can be freed
+        self.keys[slot] = None
+        self.values[slot] = None
+        self.tail = self.prev[slot]
+        if self.tail != -1:
+            self.next[self.tail] = -1
+        else:
+            # The list only had one slot
+            self.head = -1
+        self.next[slot] = self.free_head
+        self.free_head = slot
+        
+        return key, value
+    
+    def remove(self, slot):
+        """
+        Removes the slot from anywhere in the list and marks it as free.
+        """
+        key, value = self.keys[slot], self.values[slot]
+        self.keys[slot] = None
+        self.values[slot] = None
+        prevSlot = self.prev[slot]
+        nextSlot = self.next[slot]
+        if prevSlot != -1:
+            self.next[prevSlot] = nextSlot
+        else:
+            self.head = nextSlot
+        if nextSlot != -1:
+            self.prev[nextSlot] = prevSlot
+        else:
+            self.tail = prevSlot
+        self.next[slot] = self.free_head
+        self.free_head = slot
+        return key, value
+    
+    def iter_from_head(self):
+        """
+        Yields the (key, slot) pairs from the most to the least recently
+        used slot.
+        """
+        slot = self.head
+        while slot != -1:
+            yield self.keys[slot], slot
+            slot = self.next[slot]
+    
+    def iter_from_tail(self, slot=None):
+        """
+        Yields the (key, slot) pairs from the least to the most recently
+        used slot, or from the given slot on. The yielded slot may be
+        removed while iterating.
+        """
+        if slot is None:
+            slot = self.tail
+        while slot != -1:
+            prevSlot = self.prev[slot]
+            yield self.keys[slot], slot
+            slot = prevSlot
+    
+    def get_value(self, slot):
+        """
+        Returns the value stored in the slot.
+        """
+        return self.values[slot]
+        
+    def __str__(self):
+        """
+        String representation of the linked list.
+        """
+        s = ""
+        slot = self.head
+        while slot != -1:
+            s += str((self.keys[slot], self.values[slot])) + " <--> "
+            slot = self.next[slot]
+        return s
+
+
+def get_bytes_per_entry(storage, num_entries):
+    """
+    Measures the memory of a LRU_Cache with the given storage per entry,
+    once right after creating it and once after filling it with
+    num_entries items. Everything the cache allocates is counted with
+    tracemalloc, including the hash map and the slot indexes stored in
+    it, but not the keys and values themselves.
+    
+    Returns the bytes per entry of the empty and the full cache.
+    """
+    keys = list(range(1000, 1000 + num_entries))
+    tracemalloc.start()
+    try:
+        cache = LRU_Cache(num_entries, storage=storage)
+        empty = tracemalloc.get_traced_memory()[0]
+        for key in keys:
+            cache.set(key, key)
+        full = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return empty / num_entries, full / num_entries
+
+#%% [markdown]
+# ### Sharded LRU Cache
+# `LRU_Cache` is not thread-safe: `get()` and `set()` both relink nodes in the doubly linked list. `Sharded_LRU_Cache` hashes each key to one of `N` independent `LRU_Cache` shards, and every shard has its own lock. Threads that work on different shards don't block each other. Each shard evicts its own least recently used entry, so the LRU order holds per shard and not across the whole cache.
+
+#%%
+import threading
+
+class Sharded_LRU_Cache(object):
+
+    def __init__(self, capacity, num_shards=8, **kwargs):
+        """
+        Thread-safe LRU cache that splits its capacity across independent
+        LRU_Cache shards, each guarded by its own lock.
+        
+        Additional keyword arguments are passed on to every LRU_Cache.
+        """
+        assert(type(capacity) == int), "Capacity has to be an integer"
+        assert(type(num_shards) == int), "Number of shards has to be an integer"
+        assert(num_shards > 0), "Number of shards has to be larger than 0"
+        assert(capacity >= num_shards), "Capacity has to be at least the number of shards"
+        # Spread the capacity as evenly as possible, the first shards
+        # take the remainder
+        base, remainder = divmod(capacity, num_shards)
+        self.shards = [LRU_Cache(base + (1 if i < remainder else 0), **kwargs)
+                       for i in range(num_shards)]
+        self.locks = [threading.Lock() for _ in range(num_shards)]
+        self.hits = [0] * num_shards
+        self.misses = [0] * num_shards
+        self.capacity = capacity
+
+    def _get_shard_index(self, key):
+        """
+        Returns the index of the shard responsible for the key.
+        
+        Integers hash to themselves, so keys with a stride of the number
+        of shards would all land in one shard. The hash is mixed with a
+        large odd constant first, and the highest bits pick the shard.
+        """
+        mixed = (hash(key) * SHARD_HASH_MULTIPLIER) & 0xFFFFFFFFFFFFFFFF
+        return (mixed * len(self.shards)) >> 64
+
+    def get(self, key, default=-1):
+        """
+        Retrieves the item with the provided key.
+        Returns default (-1) if nonexistent.
+        """
+        i = self._get_shard_index(key)
+        with self.locks[i]:
+            shard = self.shards[i]
+            value = shard.get(key, default)
+            # Expired items are removed by get(), so only keys that
+            # are still in the shard count as hits
+            if key in shard.cache:
+                self.hits[i] += 1
+            else:
+                self.misses[i] += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """
+        Sets the value in the shard responsible for the key. If that shard
+        is at capacity, its least recently used item is removed first.
+        """
+        i = self._get_shard_index(key)
+        with self.locks[i]:
+            return self.shards[i].set(key, value, ttl)
+
+    def reap(self, max_steps):
+        """
+        Reaps up to max_steps expired items in every shard, holding only
+        one shard lock at a time. Safe to call from a background thread.
+        
+        Returns the number of removed items.
+        """
+        removed = 0
+        for i in range(len(self.shards)):
+            with self.locks[i]:
+                removed += self.shards[i].reap(max_steps)
+        return removed
+
+    def get_stats(self):
+        """
+        Returns the aggregated hit and miss counts of all shards.
+        """
+        hits = 0
+        misses = 0
+        for i in range(len(self.shards)):
+            with self.locks[i]:
+                hits += self.hits[i]
+                misses += self.misses[i]
+        return {"hits": hits, "misses": misses}
+
+    def __len__(self):
+        """
+        Returns the number of items stored in all shards.
+        """
+        return sum(len(shard.cache) for shard in self.shards)
+
+    def __str__(self):
+        """
+        String representation of the cache, one line per shard.
+        """
+        return "\n".join(str(shard) for shard in self.shards)
+
+# 2**64 divided by the golden ratio, used to spread keys over the shards
+SHARD_HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+
+#%% [markdown]
+# ### Scan resistant caches
+# A single scan over many keys that are used only once flushes all frequently used items out of an LRU cache, since every new item is put at the front of the list. The caches below have the same `get()` and `set()` interface as `LRU_Cache`, but protect frequently used items:
+# * `TwoQ_Cache` implements the 2Q algorithm: https://www.vldb.org/conf/1994/P439.PDF. New items go into a small FIFO queue first. Only items that are used again after they left that queue (and are remembered in a "ghost" list of keys) are put into the main LRU list.
+# * `TinyLFU_Cache` implements W-TinyLFU: https://arxiv.org/abs/1512.00727. New items go into a small LRU window. When an item leaves the window, it only replaces the least recently used item of the main cache if it has been accessed more often. `FrequencySketch` estimates the access frequencies with a few small counters per key.
+# 
+# `replay_trace` replays a list of keys against a cache and returns its hit ratio, so the policies can be compared on the same trace.
+
+#%%
+class TwoQ_Cache(object):
+
+    def __init__(self, capacity, default_ttl=None, clock=time.monotonic):
+        """
+        2Q cache with a FIFO queue for new items (a1in), a list of keys
+        that recently left that queue (a1out), and a LRU list for items
+        that were used more than once (am).
+        
+        default_ttl and clock work like in LRU_Cache.
+        """
+        assert(type(capacity) == int), "Capacity has to be an integer"
+        assert(capacity > 0), "Capacity has to be larger than 0"
+        assert(default_ttl is None or default_ttl > 0), "TTL has to be larger than 0"
+        self.capacity = capacity
+        # self.expires maps the key to its expiry time, only for keys
+        # that have a ttl
+        self.expires = {}
+        self.default_ttl = default_ttl
+        self.clock = clock
+        # Sizes recommended by the paper: 25% of the capacity for a1in,
+        # and a1out remembers as many keys as half of the capacity
+        self.kin = max(1, capacity // 4)
+        self.kout = max(1, capacity // 2)
+        # a1in and am map the key to the respective node, a1out only
+        # stores keys and no values
+        self.a1in = {}
+        self.a1in_ll = DoublyLinkedList()
+        self.a1out = {}
+        self.a1out_ll = DoublyLinkedList()
+        self.am = {}
+        self.am_ll = DoublyLinkedList()
+
+    def get(self, key, default=-1):
+        """
+        Retrieves the item with the provided key.
+        Returns default (-1) if nonexistent or expired.
+        """
+        if self.expires:
+            expiry = self.expires.get(key)
+            if expiry is not None and expiry <= self.clock():
+                self._remove(key)
+                return default
+        if key in self.am:
+            self.am_ll.update_node_to_mru(self.am[key])
+            return self.am_ll.get_value(self.am[key])
+        if key in self.a1in:
+            # Items in the FIFO queue keep their position
+            return self.a1in_ll.get_value(self.a1in[key])
+        return default
+
+    def set(self, key, value, ttl=None):
+        """
+        Sets the value. New items go into the FIFO queue, unless their key
+        was seen recently, then they go directly into the LRU list.
+        
+        The item expires after ttl seconds, or after default_ttl seconds
+        if ttl is None. Always returns True, like LRU_Cache.set().
+        """
+        if ttl is None:
+            ttl = self.default_ttl
+        if ttl is not None:
+            self.expires[key] = self.clock() + ttl
+        elif self.expires:
+            self.expires.pop(key, None)
+        if key in self.am:
+            self.am_ll.update_node_to_mru(self.am[key], value)
+        elif key in self.a1in:
+            self.a1in[key].set_data(value)
+        elif key in self.a1out:
+            self.a1out_ll.remove(self.a1out.pop(key))
+            self._reclaim()
+            self.am[key] = self.am_ll.prepend(key, value)
+        else:
+            self._reclaim()
+            self.a1in[key] = self.a1in_ll.prepend(key, value)
+        return True
+
+    def _remove(self, key):
+        """
+        Removes the expired item from the FIFO queue or the LRU list.
+        """
+        self.expires.pop(key)
+        if key in self.am:
+            self.am_ll.remove(self.am.pop(key))
+        else:
+            self.a1in_ll.remove(self.a1in.pop(key))
+
+    def _reclaim(self):
+        """
+        Frees one place if the cache is full. Items leaving the FIFO queue
+        are remembered in a1out.
+        """
+        if len(self.a1in) + len(self.am) < self.capacity:
+            return
+        if len(self.a1in) > self.kin or not self.am:
+            removedKey, _ = self.a1in_ll.remove_lru()
+            self.a1in.pop(removedKey)
+            self.expires.pop(removedKey, None)
+            if len(self.a1out) >= self.kout:
+                oldKey, _ = self.a1out_ll.remove_lru()
+                self.a1out.pop(oldKey)
+            self.a1out[removedKey] = self.a1out_ll.prepend(removedKey, None)
+        else:
+            removedKey, _ = self.am_ll.remove_lru()
+            self.am.pop(removedKey)
+            self.expires.pop(removedKey, None)
+
+    def __len__(self):
+        """
+        Returns the number of items stored in the cache.
+        """
+        return len(self.a1in) + len(self.am)
+
+    def __str__(self):
+        """
+        String representation of the cache
+        """
+        return "am: " + str(self.am_ll) + "\na1in: " + str(self.a1in_ll)
+
+
+#%%
+class FrequencySketch(object):
+
+    def __init__(self, capacity, depth=4):
+        """
+        Count-min sketch that estimates how often a key was seen.
+        
+        Every key is counted in one 4 bit counter per row, and the
+        estimate is the smallest of those counters. After 10 * capacity
+        increments, all counters are halved, so old accesses count less.
+        """
+        width = 1
+        while width < capacity:
+            width *= 2
+        self.mask = width - 1
+        self.rows = [array("B", [0]) * width for _ in range(depth)]
+        self.seeds = [0x9E3779B1 * (i + 1) for i in range(depth)]
+        self.additions = 0
+        self.sample_size = 10 * capacity
+
+    def _get_indexes(self, key):
+        """
+        Returns the counter index of the key in each row.
+        """
+        h = hash(key)
+        return [hash((seed, h)) & self.mask for seed in self.seeds]
+
+    def increment(self, key):
+        """
+        Counts one more access of the key.
+        """
+        for row, index in zip(self.rows, self._get_indexes(key)):
+            if row[index] < 15:
+                row[index] += 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self._reset()
+
+    def estimate(self, key):
+        """
+        Returns the estimated number of accesses of the key.
+        """
+        return min(row[index]
+                   for row, index in zip(self.rows, self._get_indexes(key)))
+
+    def _reset(self):
+        """
+        Halves all counters.
+        """
+        for row in self.rows:
+            for i in range(len(row)):
+                row[i] >>= 1
+        self.additions //= 2
+
+
+class TinyLFU_Cache(object):
+
+    def __init__(self, capacity, window_ratio=0.01, default_ttl=None,
+                 clock=time.monotonic):
+        """
+        W-TinyLFU cache: a small LRU window in front of a main LRU cache.
+        Items leaving the window are only admitted into the full main cache
+        if they are accessed more often than its least recently used item.
+        
+        Accesses are counted in get(), so misses should be followed by
+        set(), as with any other cache. default_ttl and clock work like in
+        LRU_Cache.
+        """
+        assert(type(capacity) == int), "Capacity has to be an integer"
+        assert(capacity > 1), "Capacity has to be larger than 1"
+        window_capacity = max(1, int(capacity * window_ratio))
+        self.window = LRU_Cache(window_capacity, default_ttl=default_ttl, clock=clock)
+        self.main = LRU_Cache(capacity - window_capacity,
+                              default_ttl=default_ttl, clock=clock)
+        self.sketch = FrequencySketch(capacity)
+        self.capacity = capacity
+
+    def get(self, key, default=-1):
+        """
+        Retrieves the item with the provided key.
+        Returns default (-1) if nonexistent or expired.
+        """
+        self.sketch.increment(key)
+        if key in self.window.cache:
+            return self.window.get(key, default)
+        if key in self.main.cache:
+            return self.main.get(key, default)
+        return default
+
+    def set(self, key, value, ttl=None):
+        """
+        Sets the value. New items go into the window, and the item that
+        leaves the window has to win against the main cache to stay.
+        
+        The item expires after ttl seconds, or after default_ttl seconds
+        if ttl is None. Always returns True, like LRU_Cache.set().
+        """
+        if key in self.window.cache:
+            self.window.set(key, value, ttl)
+        elif key in self.main.cache:
+            self.main.set(key, value, ttl)
+        elif len(self.window.cache) < self.window.capacity:
+            self.window.set(key, value, ttl)
+        else:
+            # The candidate keeps the rest of its time to live
+            candidateKey = next(self.window.ll.iter_from_tail())[0]
+            expiry = self.window.expires.get(candidateKey)
+            _, candidateValue = self.window.pop_lru()
+            self.window.set(key, value, ttl)
+            self._admit(candidateKey, candidateValue, expiry)
+        return True
+
+    def _admit(self, key, value, expiry):
+        """
+        Moves the item into the main cache if it has space, or if the item
+        is used more often than the one the main cache would evict.
+        Expired items are dropped.
+        """
+        ttl = None
+        if expiry is not None:
+            ttl = expiry - self.main.clock()
+            if ttl <= 0:
+                return
+        if len(self.main.cache) < self.main.capacity:
+            self.main.set(key, value, ttl)
+            return
+        victimKey, _ = next(self.main.ll.iter_from_tail())
+        if self.sketch.estimate(key) > self.sketch.estimate(victimKey):
+            self.main.set(key, value, ttl)
+
+    def __len__(self):
+        """
+        Returns the number of items stored in the cache.
+        """
+        return len(self.window.cache) + len(self.main.cache)
+
+    def __str__(self):
+        """
+        String representation of the cache
+        """
+        return "window: " + str(self.window) + "\nmain: " + str(self.main)
+
+
+#%%
+def replay_trace(cache, trace):
+    """
+    Replays a list of keys against the cache. Every key is retrieved,
+    and set if it was a miss.
+    
+    Returns the hit ratio.
+    """
+    hits = 0
+    for key in trace:
+        if cache.get(key, _NO_VALUE) is _NO_VALUE:
+            cache.set(key, True)
+        else:
+            hits += 1
+    return hits / len(trace)
+
+def compare_policies(trace, capacity):
+    """
+    Replays the trace against an empty cache of every policy.
+    
+    Returns a dict that maps the policy name to its hit ratio.
+    """
+    policies = {"LRU": LRU_Cache, "2Q": TwoQ_Cache, "W-TinyLFU": TinyLFU_Cache}
+    return {name: replay_trace(policy(capacity), trace)
+            for name, policy in policies.items()}
+
+#%% [markdown]
+# ### Memoization
+# `lru_memoize` is a decorator that caches the results of a function in a `LRU_Cache`. The arguments of a call are the key. Misses are detected with a private sentinel object, so functions can return any value, including -1.
+# 
+# If several threads call the function with the same arguments at the same time, only the first one computes the result and the others wait for it. `cache_info()` returns the hits, misses and evictions, and how much compute time the hits saved.
+
+#%%
+import functools
+
+# Returned by LRU_Cache.get() on a miss, no function can return this object
+_MISSING = object()
+# Separates positional from keyword arguments in a key
+_KWARGS_MARK = object()
+
+def _make_key(args, kwargs):
+    """
+    Returns a hashable key for the arguments of a call.
+    """
+    key = args
+    if kwargs:
+        key += (_KWARGS_MARK,) + tuple(sorted(kwargs.items()))
+    return key
+
+
+class _InFlightCall(object):
+
+    def __init__(self):
+        """
+        A computation that other threads can wait for.
+        """
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def lru_memoize(capacity, **cache_kwargs):
+    """
+    Decorator that caches the results of a function in a LRU_Cache with
+    the given capacity. Additional keyword arguments are passed on to
+    LRU_Cache, e.g. default_ttl.
+    
+    The decorated function has a cache_info() method that returns the
+    statistics as a dict. Evictions only count the items removed to make
+    room for a new result. Results that are heavier than the capacity of
+    a weighted cache are not stored and count as rejections. Calls that
+    raise count as misses and as errors.
+    """
+    def decorator(func):
+        cache = LRU_Cache(capacity, **cache_kwargs)
+        lock = threading.Lock()
+        # in_flight maps the key to the _InFlightCall computing it
+        in_flight = {}
+        stats = {"hits": 0, "misses": 0, "evictions": 0, "rejections": 0,
+                 "errors": 0, "compute_time": 0.0}
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = _make_key(args, kwargs)
+            with lock:
+                value = cache.get(key, _MISSING)
+                if value is not _MISSING:
+                    stats["hits"] += 1
+                    return value
+                call = in_flight.get(key)
+                if call is None:
+                    call = _InFlightCall()
+                    in_flight[key] = call
+                    computing = True
+                else:
+                    # Someone else computes the result already
+                    stats["hits"] += 1
+                    computing = False
+
+            if not computing:
+                call.event.wait()
+                if call.error is not None:
+                    raise call.error
+                return call.result
+
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except BaseException as error:
+                with lock:
+                    stats["misses"] += 1
+                    stats["errors"] += 1
+                    stats["compute_time"] += time.perf_counter() - start
+                    in_flight.pop(key)
+                call.error = error
+                call.event.set()
+                raise
+            elapsed = time.perf_counter() - start
+
+            with lock:
+                stats["misses"] += 1
+                stats["compute_time"] += elapsed
+                evicted = cache.evicted
+                if not cache.set(key, result):
+                    stats["rejections"] += 1
+                stats["evictions"] += cache.evicted - evicted
+                in_flight.pop(key)
+            call.result = result
+            call.event.set()
+            return result
+
+        def cache_info():
+            """
+            Returns the hits, misses, evictions, rejections, errors and
+            the average compute time of a miss. Every hit saved one
+            average compute time.
+            """
+            with lock:
+                info = dict(stats)
+            misses = info.pop("misses")
+            compute_time = info.pop("compute_time")
+            average = compute_time / misses if misses else 0.0
+            info["misses"] = misses
+            info["average_compute_time"] = average
+            info["time_saved"] = average * info["hits"]
+            return info
+
+        wrapper.cache = cache
+        wrapper.cache_info = cache_info
+        return wrapper
+    return decorator
+
+#%% [markdown]
+# ### Async LRU Cache
+# `Async_LRU_Cache` wraps a `LRU_Cache` for asyncio services. `await cache.get_or_load(key, loader)` returns the cached value, or awaits `loader(key)` on a miss and stores the result with `set()`, so items are evicted exactly like in `LRU_Cache`. Concurrent misses for the same key await the same load instead of all calling the backend. At most `max_loads` loads run at the same time.
+# 
+# All cache operations run on the event loop thread, so the cache itself needs no locks.
+
+#%%
+import asyncio
+
+class Async_LRU_Cache(object):
+
+    def __init__(self, capacity, max_loads=10, **kwargs):
+        """
+        Asyncio front end of a LRU_Cache with single-flight loading.
+        
+        Additional keyword arguments are passed on to LRU_Cache.
+        """
+        assert(type(max_loads) == int), "Max loads has to be an integer"
+        assert(max_loads > 0), "Max loads has to be larger than 0"
+        self.cache = LRU_Cache(capacity, **kwargs)
+        # self.loading maps the key to the task that loads it
+        self.loading = {}
+        self.semaphore = asyncio.Semaphore(max_loads)
+
+    def get(self, key, default=-1):
+        """
+        Retrieves the item with the provided key.
+        Returns default (-1) if nonexistent.
+        """
+        return self.cache.get(key, default)
+
+    def set(self, key, value, ttl=None):
+        """
+        Sets the value, see LRU_Cache.set().
+        """
+        return self.cache.set(key, value, ttl)
+
+    async def get_or_load(self, key, loader):
+        """
+        Returns the cached value of the key. On a miss, awaits loader(key),
+        stores the result and returns it.
+        """
+        value = self.cache.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        task = self.loading.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._load(key, loader))
+            self.loading[key] = task
+        # A cancelled caller must not cancel the load for the others
+        return await asyncio.shield(task)
+
+    async def _load(self, key, loader):
+        """
+        Loads the value, at most max_loads at the same time, and stores it.
+        """
+        try:
+            async with self.semaphore:
+                value = await loader(key)
+            self.cache.set(key, value)
+            return value
+        finally:
+            self.loading.pop(key, None)
+
+    def __str__(self):
+        """
+        String representation of the cache
+        """
+        return str(self.cache)
+
+#%% [markdown]
+# ### Instrumentation
+# `LRU_Cache.enable_stats()` replaces `get()`, `set()`, `get_many()` and `set_many()` of one cache instance with versions that count hits, misses, inserts, updates (`set()` on a key that is already cached) and evictions, and record the latency of every call in a `LatencyHistogram`. Caches without stats keep calling the plain methods, so instrumentation costs nothing until it is enabled. `CacheStats.snapshot()` exports everything as a dict.
+
+#%%
+class LatencyHistogram(object):
+
+    def __init__(self):
+        """
+        Histogram of latencies in nanoseconds. Bucket i counts the
+        latencies from 2^(i-1) to 2^i - 1 nanoseconds.
+        """
+        self.buckets = [0] * 64
+        self.count = 0
+        self.total = 0
+
+    def add(self, nanoseconds):
+        """
+        Records one latency.
+        """
+        self.buckets[min(nanoseconds.bit_length(), 63)] += 1
+        self.count += 1
+        self.total += nanoseconds
+
+    def percentile(self, p):
+        """
+        Returns the upper bound in nanoseconds of the bucket that contains
+        the p-th percentile, or 0 if nothing was recorded.
+        """
+        if not self.count:
+            return 0
+        rank = p / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= rank:
+                return 2 ** i - 1
+        return 2 ** 63 - 1
+
+    def snapshot(self):
+        """
+        Returns the count, mean, percentiles and the non-empty buckets,
+        keyed by their upper bound in nanoseconds.
+        """
+        return {
+            "count": self.count,
+            "mean_ns": self.total / self.count if self.count else 0.0,
+            "p50_ns": self.percentile(50),
+            "p99_ns": self.percentile(99),
+            "buckets": {2 ** i - 1: n for i, n in enumerate(self.buckets) if n},
+        }
+
+
+class CacheStats(object):
+
+    def __init__(self):
+        """
+        Counters and latency histograms of a cache.
+        """
+        self.hits = 0
+        self.misses = 0
+        self.inserts = 0
+        self.updates = 0
+        self.evictions = 0
+        self.rejections = 0
+        self.latency = {name: LatencyHistogram()
+                        for name in ("get", "set", "get_many", "set_many")}
+
+    def snapshot(self):
+        """
+        Returns all counters and histograms as a dict.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "inserts": self.inserts,
+            "updates": self.updates,
+            "evictions": self.evictions,
+            "rejections": self.rejections,
+            "latency": {name: histogram.snapshot()
+                        for name, histogram in self.latency.items()},
+        }
+
+
+def instrument_cache(cache, stats):
+    """
+    Sets instrumented versions of get(), set(), get_many() and set_many()
+    on the cache instance, which record into stats.
+    
+    Evictions are read from the evicted counter of the cache, so expired
+    items removed by set() don't count as evictions.
+    """
+    cls = type(cache)
+    get = cls.get.__get__(cache)
+    set_ = cls.set.__get__(cache)
+    get_many = cls.get_many.__get__(cache)
+    set_many = cls.set_many.__get__(cache)
+    clock = time.perf_counter_ns
+    latency = stats.latency
+    missing = object()
+    items = cache.cache
+
+    def instrumented_get(key, default=-1):
+        start = clock()
+        value = get(key, missing)
+        latency["get"].add(clock() - start)
+        if value is missing:
+            stats.misses += 1
+            return default
+        stats.hits += 1
+        return value
+
+    def instrumented_set(key, value, ttl=None):
+        start = clock()
+        exists = key in items
+        evicted = cache.evicted
+        stored = set_(key, value, ttl)
+        latency["set"].add(clock() - start)
+        stats.evictions += cache.evicted - evicted
+        if not stored:
+            stats.rejections += 1
+        elif exists:
+            stats.updates += 1
+        else:
+            stats.inserts += 1
+        return stored
+
+    def instrumented_get_many(keys):
+        start = clock()
+        hits, misses = get_many(keys)
+        latency["get_many"].add(clock() - start)
+        stats.hits += len(hits)
+        stats.misses += len(misses)
+        return hits, misses
+
+    def instrumented_set_many(pairs):
+        evicted = cache.evicted
+        start = clock()
+        inserted, updated, rejected = set_many(pairs)
+        latency["set_many"].add(clock() - start)
+        stats.inserts += inserted
+        stats.updates += updated
+        stats.rejections += rejected
+        stats.evictions += cache.evicted - evicted
+        return inserted, updated, rejected
+
+    cache.get = instrumented_get
+    cache.set = instrumented_set
+    cache.get_many = instrumented_get_many
+    cache.set_many = instrumented_set_many
+
 #%% [markdown]
 # ## Testcases
 
@@ -294,6 +1625,9 @@ for v in [1, 2, 1, 4, 5, 'abc', 8, 'abc']:
 # Retrieve node with key 2
 # 2
 # (2, 2) <--> (1, 10) <--> 
+# Set the value of key 1 to None
+# None
+# (1, None) <--> (2, 2) <--> 
 
 cache = LRU_Cache(2)
 for v in [1, 2]:
@@ -307,6 +1641,363 @@ print(cache)
 print("Retrieve node with key 2")
 print(cache.get(2)) # should return 2
 print(cache)
+print("Set the value of key 1 to None")
+cache.set(1, None)
+print(cache.get(1)) # should return None
+print(cache)
+
+
+#%%
+# ==== Testcase 9: Sharded cache shared between threads ====
+# max capacity: 8, 4 shards
+# Four threads each set 100 keys of their own.
+# Then 64 keys with a stride of 8 are set into 8 shards, which should
+# still be spread over all of them.
+# expected output:
+# items in cache: 8
+# {'hits': 8, 'misses': 4}
+# aligned keys spread over all shards: True
+
+print("--- Testcase 9: Sharded cache shared between threads ---")
+cache = Sharded_LRU_Cache(8, num_shards=4)
+
+def worker(offset):
+    for v in range(offset, offset + 100):
+        cache.set(v, v)
+
+threads = [threading.Thread(target=worker, args=(i * 100,)) for i in range(4)]
+for t in threads:
+    t.start()
+for t in threads:
+    t.join()
+print("items in cache:", len(cache))
+# Every shard holds the 2 keys it saw last, keys 0-3 were evicted long ago
+for shard in cache.shards:
+    for key in list(shard.cache):
+        cache.get(key)
+for v in [0, 1, 2, 3]:
+    cache.get(v)
+print(cache.get_stats())
+
+cache = Sharded_LRU_Cache(64, num_shards=8)
+for v in range(0, 64 * 8, 8):
+    cache.set(v, v)
+print("aligned keys spread over all shards:",
+      all(len(shard.cache) > 0 for shard in cache.shards))
+
+
+#%%
+# ==== Testcase 10: Array backed storage ====
+# Same operations as in testcase 3 and 4, with storage="array".
+# expected output:
+# (5, 5) <--> (4, 4) <--> (3, 3) <--> 
+# (6, 6) <--> (5, 5) <--> (4, 4) <--> 
+# get value  4  from cache:  4
+# (4, 4) <--> (6, 6) <--> (5, 5) <--> 
+# get value  3  from cache:  -1
+# (7, 7) <--> (4, 4) <--> (6, 6) <--> 
+
+print("--- Testcase 10: Array backed storage ---")
+cache = LRU_Cache(3, storage="array")
+for v in [1, 2, 3, 4, 5]:
+    cache.set(v, v)
+print(cache)
+cache.set(6, 6)
+print(cache)
+print("get value ", 4, " from cache: ", cache.get(4))
+print(cache)
+print("get value ", 3, " from cache: ", cache.get(3))
+cache.set(7, 7)
+print(cache)
+
+
+#%%
+# ==== Testcase 11: Bytes per entry of both storage types ====
+# Measures both caches with tracemalloc, empty and filled with 200000
+# entries.
+# expected output (CPython 3.11, 64 bit, numbers vary by version):
+# linked: empty 0.0 full 156.4 bytes per entry
+# array: empty 32.0 full 116.4 bytes per entry
+
+print("--- Testcase 11: Bytes per entry of both storage types ---")
+for storage in ["linked", "array"]:
+    empty, full = get_bytes_per_entry(storage, 200000)
+    print(storage + ": empty", round(empty, 1), "full", round(full, 1), "bytes per entry")
+
+
+#%%
+# ==== Testcase 12: Get and set many elements at once ====
+# max capacity: 4
+# set input: [(1, 'a'), (2, 'b'), (3, 'c'), (4, 'd'), (5, 'e')]
+# get input: [2, 9, 4, 1]
+# expected output:
+# (5, 'e') <--> (4, 'd') <--> (3, 'c') <--> (2, 'b') <--> 
+# hits:  {2: 'b', 4: 'd'}
+# misses:  [9, 1]
+# (4, 'd') <--> (2, 'b') <--> (5, 'e') <--> (3, 'c') <--> 
+
+print("--- Testcase 12: Get and set many elements at once ---")
+cache = LRU_Cache(4)
+cache.set_many([(1, 'a'), (2, 'b'), (3, 'c'), (4, 'd'), (5, 'e')])
+print(cache)
+hits, misses = cache.get_many([2, 9, 4, 1])
+print("hits: ", hits)
+print("misses: ", misses)
+print(cache)
+
+
+#%%
+# ==== Testcase 13: Items with a time to live ====
+# max capacity: 5, default ttl: 10 seconds
+# The clock is replaced by a list, so the test doesn't have to wait.
+# expected output:
+# (4, 4) <--> (3, 3) <--> (2, 2) <--> (1, 1) <--> 
+# get value  1  from cache:  -1
+# get value  2  from cache:  2
+# (2, 2) <--> (4, 4) <--> (3, 3) <--> 
+# removed by reap:  1
+# (2, 2) <--> (4, 4) <--> 
+# removed by reap:  [0, 1, 1, 1, 1, 1]
+# ('long', 1) <--> 
+
+print("--- Testcase 13: Items with a time to live ---")
+now = [0]
+cache = LRU_Cache(5, default_ttl=10, clock=lambda: now[0])
+cache.set(1, 1, ttl=2)
+cache.set(2, 2, ttl=100)
+cache.set(3, 3, ttl=5)
+cache.set(4, 4)
+print(cache)
+now[0] = 6
+# 1 is expired and removed, 2 is still valid
+print("get value ", 1, " from cache: ", cache.get(1))
+print("get value ", 2, " from cache: ", cache.get(2))
+print(cache)
+# 3 is expired but is only removed by the reaper
+print("removed by reap: ", cache.reap(max_steps=2))
+print(cache)
+# A long lived item at the end of the list doesn't block the reaper,
+# every call continues where the last one stopped
+cache = LRU_Cache(10, clock=lambda: now[0])
+cache.set('long', 1, ttl=1000)
+for v in range(5):
+    cache.set(v, v, ttl=1)
+now[0] += 2
+print("removed by reap: ", [cache.reap(max_steps=1) for _ in range(6)])
+print(cache)
+
+
+#%%
+# ==== Testcase 14: Capacity measured in weight ====
+# max capacity: 10 characters, the weight of a value is its length
+# input: [('a', 'xxx'), ('b', 'yyyy'), ('c', 'zz'), ('d', 'wwwww'), ('e', 'v' * 11)]
+# expected output:
+# ('a', 'xxx') <--> 
+# ('b', 'yyyy') <--> ('a', 'xxx') <--> 
+# ('c', 'zz') <--> ('b', 'yyyy') <--> ('a', 'xxx') <--> 
+# ('d', 'wwwww') <--> ('c', 'zz') <--> 
+# set e:  False
+# ('d', 'wwwww') <--> ('c', 'zz') <--> 
+# total weight:  7
+
+print("--- Testcase 14: Capacity measured in weight ---")
+cache = LRU_Cache(10, weigher=len)
+for key, value in [('a', 'xxx'), ('b', 'yyyy'), ('c', 'zz'), ('d', 'wwwww')]:
+    cache.set(key, value)
+    print(cache)
+# 'e' is heavier than the whole cache and is rejected
+print("set e: ", cache.set('e', 'v' * 11))
+print(cache)
+print("total weight: ", cache.total_weight)
+
+
+#%%
+# ==== Testcase 15: Scan resistant caches ====
+# max capacity: 100
+# Every access of one of 60 hot keys is followed by two keys that are
+# used only once, like in a long scan. At most 1/3 of the accesses can
+# be hits.
+# expected output:
+# LRU: 0.15
+# 2Q: 0.33
+# W-TinyLFU: 0.32
+# Both caches take a default for misses and a time to live like LRU_Cache:
+# TwoQ_Cache: 1 missing missing
+# TinyLFU_Cache: 1 missing missing
+
+print("--- Testcase 15: Scan resistant caches ---")
+import random
+random.seed(0)
+trace = []
+for i in range(20000):
+    trace.append(random.randrange(60))
+    trace.extend([1000 + 2 * i, 1001 + 2 * i])
+for name, hit_ratio in compare_policies(trace, 100).items():
+    print(name + ":", round(hit_ratio, 2))
+
+for policy in [TwoQ_Cache, TinyLFU_Cache]:
+    now = [0]
+    cache = policy(4, default_ttl=10, clock=lambda: now[0])
+    cache.set('a', 1)
+    cache.set('b', None, ttl=1)
+    now[0] = 5
+    print(policy.__name__ + ":", cache.get('a', 'missing'), cache.get('b', 'missing'),
+          cache.get('c', 'missing'))
+
+
+#%%
+# ==== Testcase 16: Memoize a function ====
+# max capacity: 2
+# The function returns -1 for odd numbers, which is cached like any
+# other value. Four threads ask for the same slow result at once, and it
+# is only computed once.
+# expected output:
+# computing 3
+# -1
+# -1
+# computing 4
+# computing 5
+# computing 6
+# computing 7
+# {'hits': 4, 'evictions': 3, 'misses': 5, 'time_saved': True}
+# With a weight of 5 characters, the result of 9 is too heavy and
+# rejected, and the result of 4 evicts the ones of 2 and 3.
+# {'evictions': 2, 'rejections': 1}
+# A call that raises counts as a miss and an error, and is not cached.
+# {'misses': 2, 'errors': 2}
+
+print("--- Testcase 16: Memoize a function ---")
+
+@lru_memoize(2)
+def slow_function(n):
+    print("computing", n)
+    time.sleep(0.05)
+    return -1 if n % 2 else n
+
+print(slow_function(3))
+print(slow_function(3))
+slow_function(4)
+slow_function(5)
+slow_function(6)
+threads = [threading.Thread(target=slow_function, args=(7,)) for _ in range(4)]
+for t in threads:
+    t.start()
+for t in threads:
+    t.join()
+info = slow_function.cache_info()
+print({"hits": info["hits"], "evictions": info["evictions"],
+       "misses": info["misses"], "time_saved": info["time_saved"] > 0.1})
+
+@lru_memoize(5, weigher=len)
+def repeat(n):
+    return "x" * n
+
+for n in [2, 3, 9, 4]:
+    repeat(n)
+info = repeat.cache_info()
+print({"evictions": info["evictions"], "rejections": info["rejections"]})
+
+@lru_memoize(2)
+def invert(n):
+    return 1 / n
+
+for n in [0, 0]:
+    try:
+        invert(n)
+    except ZeroDivisionError:
+        pass
+info = invert.cache_info()
+print({"misses": info["misses"], "errors": info["errors"]})
+
+
+#%%
+# ==== Testcase 17: Load missing elements asynchronously ====
+# max capacity: 2
+# Five coroutines ask for key 1 at the same time, it is loaded once.
+# expected output:
+# loading 1
+# [10, 10, 10, 10, 10]
+# loading 2
+# loading 3
+# (2, 20) <--> (3, 30) <--> 
+# loads:  3
+
+print("--- Testcase 17: Load missing elements asynchronously ---")
+
+async def async_testcase():
+    cache = Async_LRU_Cache(2, max_loads=2)
+    loads = []
+
+    async def loader(key):
+        print("loading", key)
+        loads.append(key)
+        await asyncio.sleep(0.01)
+        return key * 10
+
+    print(await asyncio.gather(*[cache.get_or_load(1, loader) for _ in range(5)]))
+    for key in [2, 3, 2]:
+        await cache.get_or_load(key, loader)
+    # 1 was evicted by 3, like with LRU_Cache.set()
+    print(cache)
+    print("loads: ", len(loads))
+
+asyncio.run(async_testcase())
+
+
+#%%
+# ==== Testcase 18: Save the cache and load it again ====
+# The snapshot of a cache with capacity 4 is loaded into a cache with
+# capacity 3, so the least recently used item is dropped.
+# expected output:
+# ('b', [2]) <--> ('d', -1) <--> ('c', 'three') <--> ('a', 1) <--> 
+# loaded:  3
+# ('b', [2]) <--> ('d', -1) <--> ('c', 'three') <--> 
+
+print("--- Testcase 18: Save the cache and load it again ---")
+import tempfile
+cache = LRU_Cache(4)
+cache.set_many([('a', 1), ('b', [2]), ('c', 'three'), ('d', -1)])
+cache.get('b')
+print(cache)
+with tempfile.TemporaryDirectory() as tmpdir:
+    path = os.path.join(tmpdir, "cache.snapshot")
+    cache.save_snapshot(path)
+    cache = LRU_Cache(3)
+    print("loaded: ", cache.load_snapshot(path))
+print(cache)
+
+
+#%%
+# ==== Testcase 19: Collect statistics ====
+# max capacity: 2
+# expected output:
+# {'hits': 2, 'misses': 1, 'inserts': 3, 'updates': 1, 'evictions': 1, 'rejections': 0}
+# gets measured:  3
+# sets measured:  4
+# Key 1 is evicted by 3 and inserted again in the same set_many() call.
+# {'inserts': 4, 'updates': 0, 'evictions': 2}
+
+print("--- Testcase 19: Collect statistics ---")
+cache = LRU_Cache(2)
+stats = cache.enable_stats()
+cache.set(1, 1)
+cache.set(2, 2)
+cache.set(1, 10)
+cache.set(3, 3)
+for v in [1, 2, 3]:
+    cache.get(v)
+snapshot = stats.snapshot()
+print({name: snapshot[name] for name in
+       ["hits", "misses", "inserts", "updates", "evictions", "rejections"]})
+print("gets measured: ", snapshot["latency"]["get"]["count"])
+print("sets measured: ", snapshot["latency"]["set"]["count"])
+cache.disable_stats()
+
+cache = LRU_Cache(2)
+stats = cache.enable_stats()
+cache.set_many([(1, 'a'), (2, 'b'), (3, 'c'), (1, 'd')])
+snapshot = stats.snapshot()
+print({name: snapshot[name] for name in ["inserts", "updates", "evictions"]})
 
 
 #%%
@@ -318,5 +2009,3 @@ cache = LRU_Cache(0)
 for v in [1, 2, 3]:
     cache.set(v, v)
     print(cache)
-
-
@@ -41,6 +41,776 @@ def find_files(suffix, path):
             
     return files
 
+#%% [markdown]
+# ### Iterative traversal with `os.scandir`
+# `find_files` needs one `os.path.isfile` call, and thus one extra stat system call, per entry. It also copies the result list of every subdirectory into its parent, and very deep trees hit Python's recursion limit.
+# 
+# `find_files_scandir` uses `os.scandir` instead. Its `DirEntry` objects already know whether they are files or directories, so most entries need no extra system call. Instead of recursion, it keeps a stack with the remaining entries of every directory on the current path. The results are appended to a single list, in the same order as `find_files` returns them.
+# 
+# A symbolic link to a directory on the current path would make the walk loop forever. `get_directory_key` returns the device and inode numbers of a directory, which takes one `stat` call per directory. The walk remembers the keys of the directories on the current path and skips such links. All traversal functions below do the same.
+
+#%%
+def get_directory_key(entry):
+    """
+    Returns the (device, inode) pair that identifies a directory, given
+    as a DirEntry or a path. Symbolic links are followed.
+    """
+    if isinstance(entry, str):
+        stat = os.stat(entry)
+    else:
+        stat = entry.stat()
+    return (stat.st_dev, stat.st_ino)
+
+def find_files_scandir(suffix, path):
+    """
+    Find all files beneath path with file name suffix, like find_files,
+    but without recursion and with os.scandir.
+
+    Args:
+      suffix(str): suffix if the file name to be found
+      path(str): path of the file system
+
+    Returns:
+       a list of paths
+    """
+    assert(type(suffix) == str), "Suffix has to be a string"
+    assert(type(path) == str), "Path has to be a string"
+    
+    if os.path.isfile(path) and path.endswith(suffix):
+        return [path]
+    
+    files = []
+    # Every stack element holds the entries of one directory that
+    # haven't been visited yet. keys holds the (device, inode) of every
+    # directory on the stack, visiting holds the same keys for fast
+    # lookups.
+    keys = [get_directory_key(path)]
+    visiting = set(keys)
+    with os.scandir(path) as it:
+        stack = [iter(list(it))]
+    while stack:
+        entry = next(stack[-1], None)
+        if entry is None:
+            stack.pop()
+            visiting.discard(keys.pop())
+        elif entry.is_file():
+            if entry.name.endswith(suffix):
+                files.append(entry.path)
+        elif entry.is_dir():
+            key = get_directory_key(entry)
+            if key in visiting:
+                # Symbolic link to a directory on the current path
+                continue
+            keys.append(key)
+            visiting.add(key)
+            with os.scandir(entry.path) as it:
+                stack.append(iter(list(it)))
+            
+    return files
+
+#%% [markdown]
+# ### Generator
+# `find_files_iter` yields every matching path as soon as it is found, so the caller can start working on the first file right away, or stop early. Instead of lists of entries, the stack holds the open `os.scandir` iterators of the directories on the current path. The memory therefore only grows with the depth of the tree, not with the number of results or the width of the directories. The iterators are closed when the generator is closed, also if the caller stops early.
+# 
+# It also limits what is walked:
+# * Directories whose name matches one of the `exclude` glob patterns, e.g. `".git"` or `"vendor*"`, are skipped without listing them.
+# * With `max_depth`, it only descends that many levels of subdirectories. `max_depth=0` only searches `path` itself.
+# * Like in `find_files_scandir`, symbolic links to a directory on the current path are skipped.
+# 
+# `exclude` and `max_depth` are only supported by `find_files_iter`.
+
+#%%
+import fnmatch
+import re
+
+def find_files_iter(suffix, path, exclude=None, max_depth=None):
+    """
+    Yields all files beneath path with file name suffix, in the same
+    order as find_files.
+
+    Args:
+      suffix(str): suffix if the file name to be found
+      path(str): path of the file system
+      exclude(list): glob patterns of directory names to skip
+      max_depth(int): number of subdirectory levels to search, or None
+        for no limit
+
+    Yields:
+       paths
+    """
+    assert(type(suffix) == str), "Suffix has to be a string"
+    assert(type(path) == str), "Path has to be a string"
+    assert(max_depth is None or max_depth >= 0), "Max depth can't be negative"
+    
+    if os.path.isfile(path) and path.endswith(suffix):
+        yield path
+        return
+    
+    excluded = None
+    if exclude:
+        excluded = re.compile(
+            "|".join("(?:" + fnmatch.translate(pattern) + ")" for pattern in exclude))
+    
+    # keys holds the (device, inode) of every directory on the stack,
+    # visiting holds the same keys for fast lookups
+    keys = [get_directory_key(path)]
+    visiting = set(keys)
+    stack = [os.scandir(path)]
+    try:
+        while stack:
+            entry = next(stack[-1], None)
+            if entry is None:
+                stack.pop().close()
+                visiting.discard(keys.pop())
+            elif entry.is_file():
+                if entry.name.endswith(suffix):
+                    yield entry.path
+            elif entry.is_dir():
+                if excluded is not None and excluded.match(entry.name):
+                    continue
+                if max_depth is not None and len(stack) > max_depth:
+                    continue
+                key = get_directory_key(entry)
+                if key in visiting:
+                    # Symbolic link to a directory on the current path
+                    continue
+                keys.append(key)
+                visiting.add(key)
+                stack.append(os.scandir(entry.path))
+    finally:
+        # Close the directories that are still open if the caller
+        # stopped early
+        for it in stack:
+            it.close()
+
+#%% [markdown]
+# ### Parallel traversal
+# On network storage, every directory listing waits for the network, and a serial walk spends most of its time waiting. `find_files_parallel` lists directories in a pool of threads: every listed directory adds its subdirectories as new work items. With `ordered=True` the result is sorted, so it doesn't depend on which thread finished first.
+# 
+# There is no single current path here, so every work item carries the set of directory keys on its own path. Building it takes `O(depth)` time per directory.
+
+#%%
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+def _scan_directory(suffix, path, ancestors):
+    """
+    Lists one directory and returns the matching files and the
+    (path, ancestors) pairs of the subdirectories in it. ancestors is a
+    frozenset of the keys of the directory and all directories above it.
+    Symbolic links to one of them are skipped.
+    """
+    files = []
+    subdirs = []
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_file():
+                if entry.name.endswith(suffix):
+                    files.append(entry.path)
+            elif entry.is_dir():
+                key = get_directory_key(entry)
+                if key not in ancestors:
+                    subdirs.append((entry.path, ancestors | {key}))
+    return files, subdirs
+
+def find_files_parallel(suffix, path, max_workers=8, ordered=False):
+    """
+    Find all files beneath path with file name suffix, listing up to
+    max_workers directories at the same time.
+
+    Args:
+      suffix(str): suffix if the file name to be found
+      path(str): path of the file system
+      max_workers(int): number of threads
+      ordered(bool): sort the result if True, otherwise the order
+        depends on the timing of the threads
+
+    Returns:
+       a list of paths
+    """
+    assert(type(suffix) == str), "Suffix has to be a string"
+    assert(type(path) == str), "Path has to be a string"
+    assert(type(max_workers) == int), "Number of workers has to be an integer"
+    assert(max_workers > 0), "Number of workers has to be larger than 0"
+    
+    if os.path.isfile(path) and path.endswith(suffix):
+        return [path]
+    
+    files = []
+    root = frozenset([get_directory_key(path)])
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {executor.submit(_scan_directory, suffix, path, root)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                # Raises the error of the thread, e.g. FileNotFoundError
+                subFiles, subdirs = future.result()
+                files.extend(subFiles)
+                for subdir, ancestors in subdirs:
+                    pending.add(executor.submit(
+                        _scan_directory, suffix, subdir, ancestors))
+    
+    if ordered:
+        files.sort()
+    return files
+
+#%% [markdown]
+# ### Multiple patterns in one pass
+# Searching for ".c" and ".h" files with `find_files` walks the tree twice. `find_files_multi` walks it once and sorts every file into the buckets of all patterns that match it. Patterns with `*`, `?` or `[` are glob patterns for the file name, e.g. `"test_*.py"`, all other patterns are suffixes like in `find_files`.
+# 
+# `PatternMatcher` prepares all patterns once:
+# * The suffixes are stored backwards in a trie. Walking the file name from its end through the trie finds all matching suffixes, no matter how many there are.
+# * The glob patterns are combined into a single regular expression. Only if it matches, the glob patterns are checked one by one.
+
+#%%
+import fnmatch
+import re
+
+class PatternMatcher(object):
+
+    def __init__(self, patterns):
+        """
+        Matches file names against suffixes and glob patterns.
+        """
+        # Every trie node is a dict that maps a character to the next
+        # node. The key None holds the suffixes that end at this node.
+        self.trie = {}
+        self.globs = []
+        for pattern in patterns:
+            assert(type(pattern) == str), "Patterns have to be strings"
+            if any(ch in pattern for ch in "*?["):
+                self.globs.append((pattern, re.compile(fnmatch.translate(pattern))))
+            else:
+                node = self.trie
+                for ch in reversed(pattern):
+                    node = node.setdefault(ch, {})
+                node.setdefault(None, []).append(pattern)
+        self.any_glob = None
+        if self.globs:
+            self.any_glob = re.compile(
+                "|".join("(?:" + regex.pattern + ")" for _, regex in self.globs))
+
+    def match(self, name):
+        """
+        Returns all patterns that match the file name.
+        """
+        matches = []
+        node = self.trie
+        if None in node:
+            matches.extend(node[None])
+        for ch in reversed(name):
+            node = node.get(ch)
+            if node is None:
+                break
+            if None in node:
+                matches.extend(node[None])
+        if self.any_glob is not None and self.any_glob.match(name):
+            for pattern, regex in self.globs:
+                if regex.match(name):
+                    matches.append(pattern)
+        return matches
+
+
+def find_files_multi(patterns, path):
+    """
+    Find all files beneath path that match any of the patterns, in a
+    single pass.
+
+    Args:
+      patterns(list): suffixes or glob patterns of the file names
+      path(str): path of the file system
+
+    Returns:
+       a dict that maps every pattern to a list of paths
+    """
+    assert(type(path) == str), "Path has to be a string"
+    # Every pattern only once, so no file is added to a bucket twice
+    patterns = list(dict.fromkeys(patterns))
+    matcher = PatternMatcher(patterns)
+    files = {pattern: [] for pattern in patterns}
+    
+    if os.path.isfile(path):
+        for pattern in matcher.match(os.path.basename(path)):
+            files[pattern].append(path)
+        return files
+    
+    # Skips symbolic links to a directory on the current path, like
+    # find_files_scandir
+    keys = [get_directory_key(path)]
+    visiting = set(keys)
+    with os.scandir(path) as it:
+        stack = [iter(list(it))]
+    while stack:
+        entry = next(stack[-1], None)
+        if entry is None:
+            stack.pop()
+            visiting.discard(keys.pop())
+        elif entry.is_file():
+            for pattern in matcher.match(entry.name):
+                files[pattern].append(entry.path)
+        elif entry.is_dir():
+            key = get_directory_key(entry)
+            if key in visiting:
+                continue
+            keys.append(key)
+            visiting.add(key)
+            with os.scandir(entry.path) as it:
+                stack.append(iter(list(it)))
+    
+    return files
+
+#%% [markdown]
+# ### Async traversal
+# `find_files_async` is an async generator for asyncio services. The directory listings run in the default thread pool of the event loop, so the loop is never blocked. At most `max_concurrency` listings run at the same time, and the directories that are still to be listed wait in a plain list. Files are yielded as soon as their directory is listed, in no particular order.
+# 
+# If the caller stops iterating or is cancelled, the listings that haven't started yet are cancelled right away. At most `max_concurrency` listings are already running, and their results are thrown away.
+
+#%%
+import asyncio
+
+async def find_files_async(suffix, path, max_concurrency=8):
+    """
+    Asynchronously yields all files beneath path with file name suffix.
+
+    Args:
+      suffix(str): suffix if the file name to be found
+      path(str): path of the file system
+      max_concurrency(int): number of directories listed at the same time
+
+    Yields:
+       paths
+    """
+    assert(type(suffix) == str), "Suffix has to be a string"
+    assert(type(path) == str), "Path has to be a string"
+    assert(type(max_concurrency) == int), "Max concurrency has to be an integer"
+    assert(max_concurrency > 0), "Max concurrency has to be larger than 0"
+    
+    loop = asyncio.get_running_loop()
+    if await loop.run_in_executor(None, os.path.isfile, path):
+        if path.endswith(suffix):
+            yield path
+            return
+    
+    # (path, ancestors) pairs of the directories that haven't been
+    # listed yet, see _scan_directory
+    key = await loop.run_in_executor(None, get_directory_key, path)
+    directories = [(path, frozenset([key]))]
+    pending = set()
+    try:
+        while directories or pending:
+            while directories and len(pending) < max_concurrency:
+                directory, ancestors = directories.pop()
+                pending.add(loop.run_in_executor(
+                    None, _scan_directory, suffix, directory, ancestors))
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                files, subdirs = future.result()
+                directories.extend(subdirs)
+                for file in files:
+                    yield file
+    finally:
+        for future in pending:
+            future.cancel()
+
+#%% [markdown]
+# ### Directory index
+# `DirectoryIndex` keeps the files of a tree in an index file, so queries don't have to walk the tree at all. For every directory, the index stores its modification time (mtime), the names of its files, and its subdirectories.
+# 
+# Adding, removing or renaming an entry changes the mtime of its directory. `refresh()` therefore only needs one `os.stat` call per directory, and lists only the directories whose mtime changed. The other directories are taken from the index as they are.
+# 
+# Only added, removed and renamed entries are tracked. Writing to a file changes the mtime of the file, but not of its directory, so the index doesn't store any file mtimes that would go stale.
+# 
+# A directory that is changed twice within the resolution of the file system clock keeps the same mtime. Like git, the index doesn't trust mtimes that are less than 2 seconds older than the refresh and lists those directories again next time.
+# 
+# The `os.stat` call also gives the device and inode numbers, so symbolic links to a directory on the current path are skipped like in the other traversal functions.
+
+#%%
+import json
+import time
+
+class DirectoryIndex(object):
+
+    def __init__(self, index_path, root):
+        """
+        Index of all files beneath root, stored in index_path. An existing
+        index for the same root is loaded, call refresh() to update it.
+        """
+        assert(type(index_path) == str), "Index path has to be a string"
+        assert(type(root) == str), "Root has to be a string"
+        self.index_path = index_path
+        self.root = root
+        # self.dirs maps the path of a directory to a dict with its
+        # "mtime", the names of its "files" and its "subdirs"
+        self.dirs = {}
+        if os.path.isfile(index_path):
+            with open(index_path) as f:
+                index = json.load(f)
+            if index["root"] == root:
+                self.dirs = index["dirs"]
+
+    def refresh(self):
+        """
+        Lists all directories that changed since the last refresh and
+        saves the index.
+        
+        Returns the number of listed directories.
+        """
+        # Directories changed within this time before now may change
+        # again without a new mtime
+        racy = time.time_ns() - 2 * 10 ** 9
+        dirs = {}
+        listed = 0
+        # Every stack element holds a path and the keys of the directories
+        # above it
+        stack = [(self.root, frozenset())]
+        while stack:
+            path, ancestors = stack.pop()
+            stat = os.stat(path)
+            key = (stat.st_dev, stat.st_ino)
+            if key in ancestors:
+                # Symbolic link to a directory on the current path
+                continue
+            ancestors = ancestors | {key}
+            mtime = stat.st_mtime_ns
+            old = self.dirs.get(path)
+            if old is not None and old["mtime"] == mtime:
+                info = old
+            else:
+                info = self._list_directory(path, mtime if mtime < racy else -1)
+                listed += 1
+            dirs[path] = info
+            for name in info["subdirs"]:
+                stack.append((path + "/" + name, ancestors))
+        self.dirs = dirs
+        self.save()
+        return listed
+
+    def _list_directory(self, path, mtime):
+        """
+        Returns the index entry of a directory.
+        """
+        files = []
+        subdirs = []
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_file():
+                    files.append(entry.name)
+                elif entry.is_dir():
+                    subdirs.append(entry.name)
+        return {"mtime": mtime, "files": files, "subdirs": subdirs}
+
+    def save(self):
+        """
+        Writes the index to its file. The file is written next to it first
+        and then renamed, so it is never left half written.
+        """
+        tmpPath = self.index_path + ".tmp"
+        with open(tmpPath, "w") as f:
+            json.dump({"root": self.root, "dirs": self.dirs}, f)
+        os.replace(tmpPath, self.index_path)
+
+    def find_files(self, suffix):
+        """
+        Returns a sorted list of all indexed files with file name suffix.
+        """
+        assert(type(suffix) == str), "Suffix has to be a string"
+        files = []
+        for path, info in self.dirs.items():
+            for name in info["files"]:
+                if name.endswith(suffix):
+                    files.append(path + "/" + name)
+        files.sort()
+        return files
+
+#%% [markdown]
+# ### Benchmark
+# `make_tree` creates a synthetic tree with a given number of empty files, and `benchmark_find_files` compares how long both functions take to search it.
+
+#%%
+import shutil
+import tempfile
+import time
+
+def make_tree(root, num_files, files_per_dir=100, dirs_per_dir=10):
+    """
+    Creates num_files empty files beneath root. Every directory holds
+    files_per_dir files, half ending with ".c" and half with ".h",
+    and up to dirs_per_dir subdirectories.
+    """
+    created = 0
+    directories = [root]
+    while created < num_files:
+        directory = directories.pop(0)
+        for i in range(min(files_per_dir, num_files - created)):
+            suffix = ".c" if i % 2 == 0 else ".h"
+            open(os.path.join(directory, "f" + str(i) + suffix), "w").close()
+            created += 1
+        for i in range(dirs_per_dir):
+            subdir = os.path.join(directory, "d" + str(i))
+            os.mkdir(subdir)
+            directories.append(subdir)
+
+def benchmark_find_files(num_files, functions=None):
+    """
+    Creates a tree with num_files files in a temporary directory and
+    times every function in functions on it.
+    
+    Returns a dict that maps the function name to its time in seconds.
+    """
+    if functions is None:
+        functions = [find_files, find_files_scandir, find_files_iter]
+    root = tempfile.mkdtemp()
+    try:
+        make_tree(root, num_files)
+        times = {}
+        for function in functions:
+            start = time.perf_counter()
+            # Consume the generators, too
+            for _ in function(".c", root):
+                pass
+            times[function.__name__] = time.perf_counter() - start
+        return times
+    finally:
+        shutil.rmtree(root)
+
+def benchmark_parallel(num_files, latency=0.0, max_workers=8):
+    """
+    Compares find_files_scandir and find_files_parallel on a tree with
+    num_files files. Every directory listing is delayed by latency seconds
+    to simulate network storage.
+    
+    Returns a dict with the time of both functions and the speedup.
+    """
+    scandir = os.scandir
+    def slow_scandir(path):
+        time.sleep(latency)
+        return scandir(path)
+    
+    root = tempfile.mkdtemp()
+    try:
+        make_tree(root, num_files)
+        if latency:
+            os.scandir = slow_scandir
+        start = time.perf_counter()
+        find_files_scandir(".c", root)
+        serial = time.perf_counter() - start
+        start = time.perf_counter()
+        find_files_parallel(".c", root, max_workers=max_workers)
+        parallel = time.perf_counter() - start
+    finally:
+        os.scandir = scandir
+        shutil.rmtree(root)
+    return {"serial": serial, "parallel": parallel, "speedup": serial / parallel}
+
+#%% [markdown]
+# ### Benchmark suite
+# `run_traversal_benchmarks` times every traversal function on trees of different shapes, and counts the `os.stat`, `os.lstat`, `os.listdir` and `os.scandir` calls of each run with a `SyscallCounter`. The counts don't depend on the machine, so a change that adds system calls shows up as a different number, even if the timing noise hides it.
+# 
+# The shapes are:
+# * `"wide"`: a single directory with `size` files
+# * `"deep"`: `size` nested directories with one file each
+# * `"small_dirs"`: `size` ".c" and `size` ".h" files, 2 per directory, and 10 subdirectories per directory, so most directories are small or empty
+# 
+# `os.path.isfile` calls `os.stat` and is counted. `DirEntry.is_file()`, `DirEntry.is_dir()` and `DirEntry.stat()` make their system calls in C, so the counter wraps `os.scandir` and returns entries that count them. They follow the rules of CPython on POSIX: `stat()` needs one `lstat` call, or one `stat` call for a symbolic link, and its result is cached. `is_file()` and `is_dir()` only need a `stat` call for symbolic links. This assumes that the file system reports the type of every entry, like ext4, XFS, Btrfs, APFS and tmpfs do.
+
+#%%
+import threading
+
+class _CountedEntry(object):
+
+    def __init__(self, entry, counter):
+        """
+        Wraps a DirEntry and counts the system calls its methods make.
+        """
+        self.entry = entry
+        self.counter = counter
+        self.name = entry.name
+        self.path = entry.path
+        self.has_stat = False
+        self.has_lstat = False
+
+    def _count_stat(self, follow_symlinks):
+        """
+        Counts the stat or lstat call that DirEntry.stat() makes the
+        first time. Symbolic links are only followed by stat.
+        """
+        if follow_symlinks and self.entry.is_symlink():
+            if not self.has_stat:
+                self.has_stat = True
+                self.counter.count("stat")
+        elif not self.has_lstat:
+            self.has_lstat = True
+            self.counter.count("lstat")
+
+    def stat(self, *, follow_symlinks=True):
+        self._count_stat(follow_symlinks)
+        return self.entry.stat(follow_symlinks=follow_symlinks)
+
+    def is_file(self, *, follow_symlinks=True):
+        if follow_symlinks and self.entry.is_symlink():
+            self._count_stat(True)
+        return self.entry.is_file(follow_symlinks=follow_symlinks)
+
+    def is_dir(self, *, follow_symlinks=True):
+        if follow_symlinks and self.entry.is_symlink():
+            self._count_stat(True)
+        return self.entry.is_dir(follow_symlinks=follow_symlinks)
+
+    def is_symlink(self):
+        return self.entry.is_symlink()
+
+    def inode(self):
+        return self.entry.inode()
+
+    def __fspath__(self):
+        return self.path
+
+
+class _CountedScandir(object):
+
+    def __init__(self, it, counter):
+        """
+        Wraps an os.scandir iterator and yields _CountedEntry objects.
+        """
+        self.it = it
+        self.counter = counter
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return _CountedEntry(next(self.it), self.counter)
+
+    def close(self):
+        self.it.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+
+class SyscallCounter(object):
+
+    NAMES = ("stat", "lstat", "listdir", "scandir")
+
+    def __init__(self):
+        """
+        Context manager that counts the calls of os.stat, os.lstat,
+        os.listdir and os.scandir, and the stat calls of the entries
+        returned by os.scandir, from all threads.
+        """
+        self.counts = {name: 0 for name in self.NAMES}
+        self.lock = threading.Lock()
+        self.originals = {}
+
+    def count(self, name):
+        """
+        Counts one call of the system call name.
+        """
+        with self.lock:
+            self.counts[name] += 1
+
+    def _wrap(self, name, function):
+        """
+        Returns a version of function that counts its calls.
+        """
+        def counted(*args, **kwargs):
+            self.count(name)
+            if name == "scandir":
+                return _CountedScandir(function(*args, **kwargs), self)
+            return function(*args, **kwargs)
+        return counted
+
+    def __enter__(self):
+        for name in self.NAMES:
+            self.originals[name] = getattr(os, name)
+            setattr(os, name, self._wrap(name, self.originals[name]))
+        return self
+
+    def __exit__(self, *exc_info):
+        for name, function in self.originals.items():
+            setattr(os, name, function)
+        return False
+
+
+def make_shaped_tree(root, shape, size):
+    """
+    Creates a tree of the given shape beneath root, see above.
+    Returns the number of directories, including root.
+    """
+    assert(shape in ("wide", "deep", "small_dirs")), "Unknown shape: " + str(shape)
+    if shape == "wide":
+        for i in range(size):
+            open(os.path.join(root, "f" + str(i) + ".c"), "w").close()
+        return 1
+    if shape == "deep":
+        directory = root
+        for i in range(size):
+            directory = os.path.join(directory, "d")
+            os.mkdir(directory)
+            open(os.path.join(directory, "f.c"), "w").close()
+        return size + 1
+    # small_dirs
+    make_tree(root, 2 * size, files_per_dir=2, dirs_per_dir=10)
+    directories = 0
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        directories += 1
+        stack.extend(entry.path for entry in os.scandir(directory) if entry.is_dir())
+    return directories
+
+
+def _find_files_async_list(suffix, path):
+    """
+    Collects the results of find_files_async in a new event loop.
+    """
+    async def collect():
+        return [file async for file in find_files_async(suffix, path)]
+    return asyncio.run(collect())
+
+TRAVERSAL_MODES = {
+    "find_files": find_files,
+    "find_files_scandir": find_files_scandir,
+    "find_files_iter": lambda suffix, path: list(find_files_iter(suffix, path)),
+    "find_files_parallel": find_files_parallel,
+    "find_files_multi": lambda suffix, path: find_files_multi([suffix], path)[suffix],
+    "find_files_async": _find_files_async_list,
+}
+
+def run_traversal_benchmarks(shapes=("wide", "deep", "small_dirs"), size=1000,
+                             modes=None):
+    """
+    Runs every traversal mode on a fresh tree of every shape.
+    
+    Returns a list of dicts with the shape, the mode, the number of
+    directories and results, the time in seconds and the system call
+    counts.
+    """
+    if modes is None:
+        modes = TRAVERSAL_MODES
+    results = []
+    for shape in shapes:
+        root = tempfile.mkdtemp()
+        try:
+            directories = make_shaped_tree(root, shape, size)
+            for mode, function in modes.items():
+                with SyscallCounter() as counter:
+                    start = time.perf_counter()
+                    files = function(".c", root)
+                    seconds = time.perf_counter() - start
+                result = {"shape": shape, "mode": mode,
+                          "directories": directories, "files": len(files),
+                          "seconds": seconds}
+                result.update(counter.counts)
+                results.append(result)
+        finally:
+            shutil.rmtree(root)
+    return results
+
 #%% [markdown]
 # ## Tests
 
@@ -79,6 +849,194 @@ print(find_files(".blob", "./testdir"))
 print(find_files("", "./testdir"))
 
 
+#%%
+# Input: ".c", "./testdir" and ".h", "./testdir"
+# Expected output: find_files_scandir finds the same files in the same
+# order as find_files:
+# True
+# True
+print(find_files_scandir(".c", "./testdir") == find_files(".c", "./testdir"))
+print(find_files_scandir("", "./testdir") == find_files("", "./testdir"))
+
+
+#%%
+# Input: ".c", "./testdir", and stop after the first file
+# Expected output: the same files as find_files, and only the first one
+# True
+# ['./testdir/subdir5/a.c']
+print(list(find_files_iter(".c", "./testdir")) == find_files(".c", "./testdir"))
+first = []
+for file in find_files_iter(".c", "./testdir"):
+    first.append(file)
+    break
+print(first)
+
+
+#%%
+# Input: ".c", "./testdir", without subdir3 and subdir5, and with max
+# depth 0
+# Expected output:
+# ['./testdir/subdir1/a.c', './testdir/t1.c']
+# ['./testdir/t1.c']
+print(sorted(find_files_iter(".c", "./testdir", exclude=["subdir[35]"])))
+print(list(find_files_iter(".c", "./testdir", max_depth=0)))
+
+
+#%%
+# Input: a directory with a symbolic link to itself
+# Expected output: the file is found once by every traversal function,
+# and the walk ends
+# ['.../loop/a.c']
+# find_files_scandir: True
+# find_files_parallel: True
+# find_files_multi: True
+# find_files_async: True
+# DirectoryIndex: True
+with tempfile.TemporaryDirectory() as root, tempfile.TemporaryDirectory() as indexDir:
+    os.mkdir(os.path.join(root, "loop"))
+    open(os.path.join(root, "loop", "a.c"), "w").close()
+    os.symlink(os.path.join(root, "loop"), os.path.join(root, "loop", "self"))
+    expected = list(find_files_iter(".c", root))
+    print(["..." + f[len(root):] for f in expected])
+    print("find_files_scandir:", find_files_scandir(".c", root) == expected)
+    print("find_files_parallel:", find_files_parallel(".c", root) == expected)
+    print("find_files_multi:", find_files_multi([".c"], root)[".c"] == expected)
+    
+    async def collect():
+        return [file async for file in find_files_async(".c", root)]
+    print("find_files_async:", asyncio.run(collect()) == expected)
+    index = DirectoryIndex(os.path.join(indexDir, "index.json"), root)
+    index.refresh()
+    print("DirectoryIndex:", index.find_files(".c") == expected)
+
+
+#%%
+# Input: [".c", ".h", "*1.*", ".blob"], "./testdir"
+# Expected output: the same files as find_files for the suffixes, and
+# t1.c and t1.h for the glob pattern
+# True
+# True
+# ['./testdir/t1.c', './testdir/t1.h']
+# []
+files = find_files_multi([".c", ".h", "*1.*", ".blob"], "./testdir")
+print(files[".c"] == find_files(".c", "./testdir"))
+print(files[".h"] == find_files(".h", "./testdir"))
+print(sorted(files["*1.*"]))
+print(files[".blob"])
+
+
+#%%
+# Input: ".c", "./testdir", asynchronously, and stop after two files
+# Expected output: the same files as find_files, and two files
+# True
+# 2
+async def async_testcase():
+    files = [file async for file in find_files_async(".c", "./testdir")]
+    print(sorted(files) == sorted(find_files(".c", "./testdir")))
+    
+    first = []
+    stream = find_files_async(".c", "./testdir", max_concurrency=2)
+    async for file in stream:
+        first.append(file)
+        if len(first) == 2:
+            break
+    # Cancels the listings that are still pending
+    await stream.aclose()
+    print(len(first))
+
+asyncio.run(async_testcase())
+
+
+#%%
+# Input: a tree with 2000 files in 1001 directories, then a new file
+# Expected output: the first refresh lists all directories, the second
+# none, and after adding a file only its directory
+# listed:  1001
+# listed:  0
+# listed:  1
+# True
+with tempfile.TemporaryDirectory() as root, tempfile.TemporaryDirectory() as indexDir:
+    make_tree(root, 2000, files_per_dir=20)
+    # Pretend the tree was created an hour ago, so its mtimes are trusted
+    hourAgo = time.time_ns() - 3600 * 10 ** 9
+    directories = [root]
+    while directories:
+        directory = directories.pop()
+        os.utime(directory, ns=(hourAgo, hourAgo))
+        directories.extend(entry.path for entry in os.scandir(directory) if entry.is_dir())
+    index = DirectoryIndex(os.path.join(indexDir, "index.json"), root)
+    print("listed: ", index.refresh())
+    print("listed: ", index.refresh())
+    open(os.path.join(root, "d3", "new.c"), "w").close()
+    print("listed: ", index.refresh())
+    print(index.find_files(".c") == sorted(find_files(".c", root)))
+
+
+#%%
+# Input: ".c", "./testdir", in parallel and sorted
+# Expected output: the same files as find_files, sorted
+# True
+print(find_files_parallel(".c", "./testdir", ordered=True) == sorted(find_files(".c", "./testdir")))
+
+
+#%%
+# Input: 5000 files, 100 per directory, 5 ms per directory listing
+# Expected output: the parallel walk with 8 threads should be about
+# 6-8 times faster
+result = benchmark_parallel(5000, latency=0.005)
+print("speedup: ", round(result["speedup"], 1))
+
+
+#%%
+# Input: trees of all shapes with size 300 (find_files can't walk much
+# deeper trees because of the recursion limit)
+# Expected output: a table of all runs. find_files needs a stat call for
+# every entry, the scandir based modes one listing per directory and
+# one stat call per directory for the cycle detection. A mode that calls
+# DirEntry.stat() for every entry is caught by the same check.
+# All system call counts as expected
+# stat per entry caught: True
+results = run_traversal_benchmarks(size=300)
+print("{:<12}{:<22}{:>6}{:>6}{:>10}{:>6}{:>6}{:>8}{:>8}".format(
+    "shape", "mode", "dirs", "files", "seconds", "stat", "lstat", "listdir", "scandir"))
+for r in results:
+    print("{:<12}{:<22}{:>6}{:>6}{:>10.4f}{:>6}{:>6}{:>8}{:>8}".format(
+        r["shape"], r["mode"], r["directories"], r["files"], r["seconds"],
+        r["stat"], r["lstat"], r["listdir"], r["scandir"]))
+
+def stat_calls_as_expected(r):
+    if r["mode"] == "find_files":
+        # One listing per directory, plus one stat per entry and per
+        # directory from os.path.isfile
+        return (r["listdir"] == r["directories"] and
+                r["stat"] >= r["files"] + r["directories"])
+    # One listing per directory, one stat per directory below the root,
+    # and two for the root itself
+    return (r["scandir"] == r["directories"] and
+            r["stat"] + r["lstat"] <= r["directories"] + 1)
+
+for r in results:
+    assert stat_calls_as_expected(r), r
+print("All system call counts as expected")
+
+def find_files_stat_every_entry(suffix, path):
+    return [entry.path for entry in os.scandir(path)
+            if entry.stat().st_size >= 0 and entry.name.endswith(suffix)]
+
+results = run_traversal_benchmarks(shapes=("wide",), size=300,
+                                   modes={"stat_every_entry": find_files_stat_every_entry})
+print("stat per entry caught:", not stat_calls_as_expected(results[0]))
+
+
+#%%
+# Input: 20000 files, 100 per directory
+# Expected output: the time of both functions, find_files_scandir
+# should be about 2-3 times faster. Use 1000000 files for large trees,
+# which takes a few minutes just to create the tree.
+for name, seconds in benchmark_find_files(20000).items():
+    print(name + ": ", round(seconds, 3), "s")
+
+
 #%%
 # NOTE: empty directories are not committed to github, so you might get an error message here.
 #
@@ -96,6 +1054,7 @@ print(find_files("blob", "./katdir"))
 # FileNotFoundError.
 print(find_files(".c", "./doesnotexist"))
 
+
 #%% [markdown]
 # ## Code to demonstrate the use of some of the OS modules in python
 # Just keeping this for personal reference.
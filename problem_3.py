@@ -103,8 +103,16 @@ class HuffmanTree:
 # ### Helper functions
 # * `merge_trees` takes two Huffman trees and merges them
 # * `get_forest` takes a string and returns single node Huffman trees
+# * `count_frequencies` and `get_forest_from_frequencies` are the two steps of `get_forest`, so the frequencies can also be counted in several chunks
 
 #%%
+from collections import Counter
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 def merge_trees(tree1, tree2):
     """
     Merges two Huffman trees into a new tree, with the weight of the
@@ -124,14 +132,85 @@ def get_forest(data):
     """
     Counts the frequency of all letters in data and returns a forest
     of single node Huffman trees.
+    
+    Data is a string, or a bytes-like object such as bytes, memoryview
+    or mmap, in which every byte is a letter.
+    """
+    assert(isinstance(data, str) or _is_bytes_like(data)), \
+        "Input argument 'data' has to be a string or bytes-like"
+    return get_forest_from_frequencies(count_frequencies(data))
+
+def _is_bytes_like(data):
+    """
+    Returns True if data supports the buffer protocol.
+    """
+    try:
+        memoryview(data).release()
+        return True
+    except TypeError:
+        return False
+
+def count_frequencies(data, frequency=None):
+    """
+    Counts the frequency of all letters in data, and adds them to the
+    frequency hash map if one is given. Returns the hash map.
+    
+    Strings are counted with collections.Counter. Bytes-like data is
+    counted by count_byte_frequencies, with the byte values as letters
+    (chr(byte), the same as decoding with latin-1).
+    """
+    if not isinstance(data, str):
+        return count_byte_frequencies(data, frequency)
+    if frequency is None:
+        frequency = {}
+    for letter, count in Counter(data).items():
+        frequency[letter] = frequency.get(letter, 0) + count
+    return frequency
+
+def count_byte_frequencies(data, frequency=None):
+    """
+    Counts the frequency of all byte values in bytes-like data with
+    numpy.bincount, or with collections.Counter if NumPy is not installed.
+    Adds them to the frequency hash map if one is given, and returns it.
+    """
+    if frequency is None:
+        frequency = {}
+    with memoryview(data) as view:
+        if not view.c_contiguous:
+            # cast() only works on contiguous views, e.g. not on view[::2]
+            view = memoryview(view.tobytes())
+        with view.cast("B") as view:
+            if numpy is not None:
+                counts = numpy.bincount(numpy.frombuffer(view, dtype=numpy.uint8),
+                                        minlength=256).tolist()
+            else:
+                counts = [0] * 256
+                for byte, count in Counter(view).items():
+                    counts[byte] = count
+    for byte, count in enumerate(counts):
+        if count:
+            letter = chr(byte)
+            frequency[letter] = frequency.get(letter, 0) + count
+    return frequency
+
+def count_frequencies_loop(data):
+    """
+    Counts the frequency of all letters in data one by one. This is the
+    original counting loop, kept to compare against count_frequencies.
     """
-    assert(type(data) == str), "Input argument 'data' has to be a string"
     frequency = {}
     for letter in data:
         if letter in frequency:
             frequency[letter] += 1
         else:
             frequency[letter] = 1
+    return frequency
+
+def get_forest_from_frequencies(frequency):
+    """
+    Returns a forest of single node Huffman trees for a hash map that
+    maps letters to their frequencies.
+    """
     forest = []
     for letter, weight in frequency.items():
         tree = HuffmanTree()
@@ -148,6 +227,45 @@ def get_forest(data):
         
     return forest
 
+#%% [markdown]
+# ### Building the Huffman tree
+# * `build_tree_sorted` is the original loop: it sorts the whole forest before every merge and pops the two lightest trees from the front of the list. That takes `O(N^2*log(N))` time for `N` letters.
+# * `build_tree_heap` keeps the forest in a min-heap, so every merge takes `O(log(N))` and the whole tree `O(N*log(N))`. Trees with the same weight are taken in the order in which they were added to the forest. This is the same order in which the stable sort of `build_tree_sorted` takes them, so both build exactly the same tree and the codes are reproducible.
+
+#%%
+import heapq
+
+def build_tree_sorted(forest):
+    """
+    Merges the forest of (weight, tree) tuples into a single Huffman tree
+    by sorting the forest before every merge. Returns the tree.
+    """
+    while len(forest) > 1:
+        forest = sorted(forest, key=lambda weight: weight[0])
+        tree1 = forest.pop(0)[1]
+        tree2 = forest.pop(0)[1]
+        merged_tree = merge_trees(tree1, tree2)
+        forest.append((merged_tree.get_weight(), merged_tree))
+    return forest[0][1]
+
+def build_tree_heap(forest):
+    """
+    Merges the forest of (weight, tree) tuples into a single Huffman tree
+    using a min-heap. Returns the tree.
+    """
+    # The counter breaks ties between equal weights by insertion order,
+    # and keeps heapq from ever comparing two trees
+    heap = [(weight, i, tree) for i, (weight, tree) in enumerate(forest)]
+    heapq.heapify(heap)
+    counter = len(heap)
+    while len(heap) > 1:
+        _, _, tree1 = heapq.heappop(heap)
+        _, _, tree2 = heapq.heappop(heap)
+        merged_tree = merge_trees(tree1, tree2)
+        heapq.heappush(heap, (merged_tree.get_weight(), counter, merged_tree))
+        counter += 1
+    return heap[0][2]
+
 #%% [markdown]
 # ### Helper functions
 # * `map_char_to_binary` creates a dictionary that maps letters to their equivalent binary representation based on the Huffman tree
@@ -182,73 +300,747 @@ def encode_data(data, tree):
         b += ch_to_b[ch]
     return b
 
+#%% [markdown]
+# ### Packed bits
+# `encode_data` returns the code as a string of "0" and "1" characters, which takes at least one byte per bit. `encode_data_packed` packs 8 bits into every byte instead and returns a `PackedCode` with the bytes and the number of bits, because the last byte may be padded with zeros.
+# 
+# The codes of all letters are converted to integers once. An integer accumulator collects the bits of the letters, and whenever it holds at least 8 bits, the first 8 are written to a `bytearray`. The first bit of the code is the highest bit of the first byte. The loop is `pack_codes` in `huffman_blocks.py`, which the parallel compression below uses as well.
+
+#%%
+from huffman_blocks import pack_codes
+
+class PackedCode:
+    def __init__(self, data, bit_length):
+        """
+        Huffman code packed into bytes, with the number of valid bits.
+        """
+        self.data = data
+        self.bit_length = bit_length
+        
+    def __len__(self):
+        """
+        Returns the number of bits.
+        """
+        return self.bit_length
+    
+    def __str__(self):
+        """
+        String representation of the bits, like the code of encode_data.
+        """
+        if not self.bit_length:
+            return ""
+        bits = bin(int.from_bytes(self.data, "big"))[2:].zfill(8 * len(self.data))
+        return bits[:self.bit_length]
+
+def map_char_to_int(data, tree):
+    """
+    Creates a hash map that maps the letter to its code as an integer
+    and the number of bits of the code.
+    """
+    return {letter: (int(code, 2), len(code))
+            for letter, code in map_char_to_binary(data, tree).items()}
+
+def encode_data_packed(data, tree):
+    """
+    Returns the encoded data as a PackedCode, based on the original data
+    and the equivalent Huffman tree.
+    """
+    return pack_data(data, map_char_to_int(data, tree))
+
+def pack_data(data, ch_to_int):
+    """
+    Returns the data as a PackedCode, with ch_to_int mapping every
+    letter to its code as an integer and the number of bits of the code.
+    """
+    return PackedCode(*pack_codes(data, ch_to_int))
+
 #%% [markdown]
 # ### huffman_encoding and huffman_decoding
 # * `huffman_encoding` creates a Huffman tree from the data and returns both the encoded data and the tree.
 # * `huffman_decoding` takes the encoded data and Huffman tree, and decodes the data back into its original form.
 
 #%%
-def huffman_encoding(data):
+def huffman_encoding(data, packed=False):
     """
     Creates a Huffman tree from the data and returns both the
     encoded data and the tree.
+    
+    If packed is True, the encoded data is a PackedCode instead of a
+    string of "0" and "1" characters.
     """
     assert(type(data) == str), "Input argument 'data' has to be a string"
     assert(len(data) > 0), "An empty string is not a valid input"
     forest = get_forest(data)
-    
-    while len(forest) > 1:
-        forest = sorted(forest, key=lambda weight: weight[0])
-        tree1 = forest.pop(0)[1]
-        tree2 = forest.pop(0)[1]
-        merged_tree = merge_trees(tree1, tree2)
-        forest.append((merged_tree.get_weight(), merged_tree))
-    tree = forest[0][1]
-    code = encode_data(data, tree)
+    tree = build_tree_heap(forest)
+    if packed:
+        code = encode_data_packed(data, tree)
+    else:
+        code = encode_data(data, tree)
     return code, tree
 
 def huffman_decoding(data, tree):
     """
-    Decodes and returns the decoded data.
+    Decodes and returns the decoded data. The data is either a string
+    of "0" and "1" characters or a PackedCode.
     """
     assert(type(tree) == HuffmanTree), "Tree has to be a HuffmanTree"
     root = tree.get_root()
     if not root:
         return ""
-    node = root
-    s = ""
     # Handle the special case then the Huffman tree has only
     # one node/letter
     if not root.left and not root.right:
         raise Exception("The tree contains only one letter, this case has not been implemented yet.")
+    if isinstance(data, PackedCode):
+        decoder = TableDecoder(map_char_to_int(None, tree))
+        return decoder.decode(data.data, data.bit_length)
+    node = root
+    s = ""
 
     for b_num in data:
         if node.letter:
             s += node.letter
             node = root
-        if b_num is "0":
+        if b_num == "0":
             node = node.left
         else:
             node = node.right
     s += node.letter
     return s
 
+def decode_packed(code, tree):
+    """
+    Decodes a PackedCode by reading its bits directly from the bytes.
+    """
+    root = tree.get_root()
+    if not root.left and not root.right:
+        raise Exception("The tree contains only one letter, this case has not been implemented yet.")
+    letters = []
+    node = root
+    remaining = code.bit_length
+    for byte in code.data:
+        for shift in range(7, -1, -1):
+            if not remaining:
+                break
+            remaining -= 1
+            if (byte >> shift) & 1:
+                node = node.right
+            else:
+                node = node.left
+            if node.letter:
+                letters.append(node.letter)
+                node = root
+    return "".join(letters)
+
+#%% [markdown]
+# ### Table driven decoder
+# `huffman_decoding` and `decode_packed` walk the tree one bit at a time. `TableDecoder` in `huffman_blocks.py` reads a whole byte at once and looks it up in a table with 256 entries. It only needs the codes of the letters, not the tree, so it decodes the packed codes of all functions below.
+# 
+# The decoder keeps the bits of the code read so far as its state, with a leading 1 bit so that codes of different lengths differ. This is the same as a node of the tree: the state 1 is the root, and every complete code is a letter. Every entry of a table holds all letters that are complete within these 8 bits, and the state where the 8 bits end.
+# 
+# The walk continues from that state with the next byte, so every state has its own table. The table of the state 1 is the primary table, the others are secondary tables for codes that don't end at a byte boundary, e.g. codes longer than 8 bits. Tables are built on first use, so only the tables of states that are actually reached are created.
+# 
+# The decoded letters are collected in a list and joined once at the end. The bits of the last byte are decoded one by one, since it may be padded.
+
+#%%
+from huffman_blocks import TableDecoder
+
+#%% [markdown]
+# ### Canonical codes and a container format
+# To decode the data in another process, the receiver needs the codes, and an in-memory `HuffmanTree` can't be stored or sent without pickling its nodes. Canonical Huffman codes only need the code length of every letter: the letters are sorted by code length and then by letter, and each letter gets the next free code of its length. `canonical_codes` assigns these codes based on the lengths from `map_char_to_binary`, so they compress the data exactly as well as the original codes.
+# 
+# `huffman_compress` returns a self-contained blob of bytes:
+# * 4 bytes: the magic bytes `HUF1`
+# * 4 bytes: the number of letters `N`
+# * `N` times 4 bytes: the letter as a 3 byte code point and its code length
+# * 8 bytes: the number of bits of the code
+# * the packed code
+# 
+# `huffman_decompress` reads the header, assigns the same canonical codes and decodes the data with `TableDecoder`, without building a tree. All numbers are stored big-endian.
+
+#%%
+import struct
+
+HUFFMAN_MAGIC = b"HUF1"
+
+def get_code_lengths(tree):
+    """
+    Returns a hash map that maps every letter to the length of its code.
+    """
+    return {letter: len(code) for letter, code in map_char_to_binary(None, tree).items()}
+
+def canonical_codes(lengths):
+    """
+    Assigns canonical Huffman codes to letters with the given code
+    lengths. Returns a hash map that maps every letter to its code as an
+    integer and the number of bits of the code.
+    """
+    codes = {}
+    code = 0
+    previous_length = 0
+    for letter, length in sorted(lengths.items(), key=lambda item: (item[1], item[0])):
+        code <<= length - previous_length
+        codes[letter] = (code, length)
+        code += 1
+        previous_length = length
+    return codes
+
+def encode_code_lengths(lengths):
+    """
+    Returns the header bytes for the code lengths: the number of letters,
+    and a 3 byte code point and 1 byte length for every letter.
+    """
+    assert(max(lengths.values()) < 256), "Codes longer than 255 bits are not supported"
+    header = bytearray(struct.pack(">I", len(lengths)))
+    for letter, length in lengths.items():
+        header += ord(letter).to_bytes(3, "big") + bytes([length])
+    return bytes(header)
+
+def decode_code_lengths(blob, position=0):
+    """
+    Reads the code lengths written by encode_code_lengths, starting at
+    position. Returns the code lengths and the position after them.
+    """
+    count, = struct.unpack_from(">I", blob, position)
+    position += 4
+    lengths = {}
+    for _ in range(count):
+        letter = chr(int.from_bytes(blob[position:position + 3], "big"))
+        lengths[letter] = blob[position + 3]
+        position += 4
+    return lengths, position
+
+def huffman_compress(data):
+    """
+    Encodes the data with canonical Huffman codes and returns a blob of
+    bytes with the code lengths and the packed code.
+    """
+    assert(type(data) == str), "Input argument 'data' has to be a string"
+    assert(len(data) > 0), "An empty string is not a valid input"
+    tree = build_tree_heap(get_forest(data))
+    lengths = get_code_lengths(tree)
+    packed = pack_data(data, canonical_codes(lengths))
+    return (HUFFMAN_MAGIC + encode_code_lengths(lengths) +
+            struct.pack(">Q", packed.bit_length) + packed.data)
+
+def huffman_decompress(blob):
+    """
+    Decodes a blob of bytes returned by huffman_compress.
+    """
+    if blob[:4] != HUFFMAN_MAGIC:
+        raise ValueError("Not a Huffman compressed blob")
+    lengths, position = decode_code_lengths(blob, 4)
+    bit_length, = struct.unpack_from(">Q", blob, position)
+    position += 8
+    return TableDecoder(canonical_codes(lengths)).decode(blob[position:], bit_length)
+
+#%% [markdown]
+# ### Streaming
+# `huffman_encode_stream` compresses a binary file-like object into another one without reading it into memory at once. Every byte is a letter: it is turned into the character with the same code point (latin-1), so all functions above work for bytes, too.
+# 1. The first pass reads the input in chunks of `chunk_size` bytes and counts the frequencies with `count_frequencies`. Then it seeks back to the start. With `sample_size`, only the first `sample_size` bytes are counted, and every byte value gets one extra count so that every byte has a code. The sample is kept in memory and the input doesn't need to be seekable.
+# 2. The second pass encodes every chunk into a block.
+# 
+# The output starts with the magic bytes `HUFS` and the code lengths like in `huffman_compress`. Every block has an 8 byte header with its number of bits, followed by its packed bits. A block with 0 bits marks the end. `huffman_decode_stream` decodes one block at a time, so both functions only need memory for one chunk.
+
+#%%
+STREAM_MAGIC = b"HUFS"
+
+def huffman_encode_stream(source, target, chunk_size=1 << 20, sample_size=None):
+    """
+    Compresses the binary file-like object source into target in blocks
+    of chunk_size bytes. Returns the number of compressed bytes.
+    """
+    assert(chunk_size > 0), "Chunk size has to be larger than 0"
+    if sample_size is None:
+        start = source.tell()
+        frequency = {}
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            count_frequencies(chunk, frequency)
+        source.seek(start)
+        sample = b""
+    else:
+        sample = source.read(sample_size)
+        frequency = {chr(byte): 1 for byte in range(256)}
+        count_frequencies(sample, frequency)
+    
+    target.write(STREAM_MAGIC)
+    if not frequency:
+        # Empty input, there is nothing to encode
+        target.write(encode_code_lengths({chr(0): 1}))
+        target.write(struct.pack(">Q", 0))
+        return 0
+    tree = build_tree_heap(get_forest_from_frequencies(frequency))
+    lengths = get_code_lengths(tree)
+    codes = canonical_codes(lengths)
+    target.write(encode_code_lengths(lengths))
+    
+    size = 0
+    position = 0
+    while True:
+        # Encode the kept sample first, then continue with the source
+        if position < len(sample):
+            chunk = sample[position:position + chunk_size]
+            position += len(chunk)
+        else:
+            chunk = source.read(chunk_size)
+        if not chunk:
+            break
+        packed = pack_data(chunk.decode("latin-1"), codes)
+        target.write(struct.pack(">Q", packed.bit_length))
+        target.write(packed.data)
+        size += len(chunk)
+    target.write(struct.pack(">Q", 0))
+    return size
+
+def huffman_decode_stream(source, target):
+    """
+    Decompresses the binary file-like object source, written by
+    huffman_encode_stream, into target. Returns the number of
+    decompressed bytes.
+    """
+    if source.read(4) != STREAM_MAGIC:
+        raise ValueError("Not a Huffman compressed stream")
+    count = source.read(4)
+    pairs = source.read(4 * struct.unpack(">I", count)[0])
+    lengths, _ = decode_code_lengths(count + pairs)
+    decoder = TableDecoder(canonical_codes(lengths))
+    size = 0
+    while True:
+        bit_length, = struct.unpack(">Q", source.read(8))
+        if not bit_length:
+            break
+        block = source.read((bit_length + 7) // 8)
+        chunk = decoder.decode(block, bit_length).encode("latin-1")
+        target.write(chunk)
+        size += len(chunk)
+    return size
+
+#%% [markdown]
+# ### Parallel compression
+# `huffman_compress_parallel` splits bytes into independent blocks of `block_size` bytes and encodes them in a pool of processes. With `shared_table=True`, all blocks use the canonical codes of the whole data, which is stored once. Otherwise, every block gets its own codes, which compresses better if the data changes from block to block, and the code lengths are stored in front of each block.
+# 
+# The output starts with the magic bytes `HUFP`, one byte for the table mode, the shared code lengths (if any), the number of blocks and a block index. The index has 4 numbers of 8 bytes per block: the offset of the block after the index, its compressed size, its original size and its number of bits. With the index:
+# * `huffman_decompress_parallel` decodes all blocks in a pool of processes.
+# * `huffman_decompress_block` decodes a single block without touching the others.
+# 
+# The code lengths are computed here, and the workers only pack and unpack the bits with `encode_block` and `decode_block` from `huffman_blocks.py`, which call the same `pack_codes` and `TableDecoder` as the functions above. They live in their own module so that the pool can import them with the default start method of every platform. The input is sliced with a `memoryview`, and a block is only copied when it is sent to a worker, with at most 2 blocks per worker on their way at a time.
+# 
+# With `max_workers=1`, the blocks are processed in this process. If the platform has no working process pool, they are processed here as well, with a `RuntimeWarning`.
+# 
+# With the "spawn" and "forkserver" start methods (the default on Windows, macOS and, from Python 3.14, Linux), every worker runs the main script again when it starts. In Jupyter this doesn't happen. In a script, all code that runs at the top level, not only the call of these functions, has to be behind an `if __name__ == "__main__":` guard. Otherwise every worker runs it as well, and a worker that fails while it starts breaks the whole pool. This is why every test cell of this file has the guard.
+
+#%%
+import os
+import warnings
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from huffman_blocks import encode_block, decode_block
+
+PARALLEL_MAGIC = b"HUFP"
+INDEX_ENTRY = struct.Struct(">QQQQ")
+
+def _map_blocks(function, tasks, max_workers):
+    """
+    Yields function(*task) for every task of the iterable tasks, in the
+    same order, computed in a pool of up to max_workers processes.
+    """
+    if max_workers == 1:
+        for task in tasks:
+            yield function(*task)
+        return
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    try:
+        executor = ProcessPoolExecutor(max_workers=max_workers)
+    except (NotImplementedError, ImportError, OSError) as error:
+        warnings.warn("No process pool available, processing the blocks "
+                      "one after another: " + str(error), RuntimeWarning)
+        for task in tasks:
+            yield function(*task)
+        return
+    with executor:
+        # Only submit a few tasks ahead, so that not all blocks are
+        # copied into the pool at once
+        pending = deque()
+        for task in tasks:
+            pending.append(executor.submit(function, *task))
+            if len(pending) >= 2 * max_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def _get_block_lengths(block):
+    """
+    Returns the code lengths of the Huffman tree for a block of bytes.
+    """
+    return get_code_lengths(build_tree_heap(get_forest(block)))
+
+def huffman_compress_parallel(data, block_size=1 << 20, max_workers=None, shared_table=True):
+    """
+    Compresses bytes-like data in independent blocks, using up to
+    max_workers processes. max_workers=None uses one per CPU, and
+    max_workers=1 compresses in this process. Returns the compressed
+    bytes.
+    """
+    assert(_is_bytes_like(data)), "Input argument 'data' has to be bytes-like"
+    assert(block_size > 0), "Block size has to be larger than 0"
+    view = memoryview(data)
+    if not view.c_contiguous:
+        view = memoryview(view.tobytes())
+    view = view.cast("B")
+    starts = range(0, len(view), block_size)
+    
+    out = [PARALLEL_MAGIC]
+    codes = None
+    if shared_table:
+        if len(view):
+            lengths = _get_block_lengths(view)
+        else:
+            lengths = {chr(0): 1}
+        codes = canonical_codes(lengths)
+        out += [b"\x00", encode_code_lengths(lengths)]
+    else:
+        out.append(b"\x01")
+    
+    # The code lengths in front of every block, for per block codes
+    headers = []
+    def get_tasks():
+        for start in starts:
+            block = view[start:start + block_size]
+            blockCodes = codes
+            if blockCodes is None:
+                lengths = _get_block_lengths(block)
+                headers.append(encode_code_lengths(lengths))
+                blockCodes = canonical_codes(lengths)
+            yield bytes(block), blockCodes
+    
+    index = [struct.pack(">I", len(starts))]
+    payloads = []
+    offset = 0
+    results = _map_blocks(encode_block, get_tasks(), max_workers)
+    for number, (payload, bit_length) in enumerate(results):
+        if headers:
+            payloads.append(headers[number])
+        payloads.append(payload)
+        size = len(payload) + (len(headers[number]) if headers else 0)
+        original = min(block_size, len(view) - starts[number])
+        index.append(INDEX_ENTRY.pack(offset, size, original, bit_length))
+        offset += size
+    return b"".join(out + index + payloads)
+
+def read_block_index(blob):
+    """
+    Reads the header of a blob written by huffman_compress_parallel.
+    
+    Returns the shared code lengths (None for per block codes), the list
+    of (offset, size, original size, bits) of every block, and the
+    position where the blocks start.
+    """
+    if blob[:4] != PARALLEL_MAGIC:
+        raise ValueError("Not a parallel Huffman compressed blob")
+    position = 5
+    lengths = None
+    if blob[4] == 0:
+        lengths, position = decode_code_lengths(blob, position)
+    count, = struct.unpack_from(">I", blob, position)
+    position += 4
+    index = []
+    for _ in range(count):
+        index.append(INDEX_ENTRY.unpack_from(blob, position))
+        position += INDEX_ENTRY.size
+    return lengths, index, position
+
+def _get_decode_task(blob, start, entry, codes):
+    """
+    Returns the payload, the number of bits and the codes of the block
+    with the index entry. codes is None for per block codes.
+    """
+    offset, size, _, bit_length = entry
+    position = start + offset
+    if codes is None:
+        lengths, position = decode_code_lengths(blob, position)
+        codes = canonical_codes(lengths)
+    return bytes(blob[position:start + offset + size]), bit_length, codes
+
+def huffman_decompress_block(blob, number):
+    """
+    Decodes only the block with the given number of a blob written by
+    huffman_compress_parallel, in this process.
+    """
+    lengths, index, start = read_block_index(blob)
+    codes = canonical_codes(lengths) if lengths is not None else None
+    return decode_block(*_get_decode_task(blob, start, index[number], codes))
+
+def huffman_decompress_parallel(blob, max_workers=None):
+    """
+    Decodes all blocks of a blob written by huffman_compress_parallel,
+    using up to max_workers processes.
+    """
+    lengths, index, start = read_block_index(blob)
+    codes = canonical_codes(lengths) if lengths is not None else None
+    tasks = (_get_decode_task(blob, start, entry, codes) for entry in index)
+    return b"".join(_map_blocks(decode_block, tasks, max_workers))
+
+#%% [markdown]
+# ### Benchmark
+# `benchmark_build_tree` builds the tree of an alphabet with random letter frequencies with both functions. `build_tree_sorted` is only timed up to `max_sorted_size` letters, since it takes minutes for the largest alphabets.
+
+#%%
+import random
+import time
+
+def benchmark_build_tree(sizes, max_sorted_size=4096):
+    """
+    Times build_tree_sorted and build_tree_heap for alphabets with the
+    given numbers of letters.
+    
+    Returns a dict that maps the size to the (sorted, heap) times in
+    seconds, with None for sizes that were not timed.
+    """
+    rng = random.Random(0)
+    times = {}
+    for size in sizes:
+        forest = []
+        for i in range(size):
+            tree = HuffmanTree()
+            tree.set_root(chr(i + 1))
+            tree.set_weight(rng.randint(1, 1000))
+            forest.append((tree.get_weight(), tree))
+        sorted_time = None
+        if size <= max_sorted_size:
+            start = time.perf_counter()
+            build_tree_sorted(list(forest))
+            sorted_time = time.perf_counter() - start
+        start = time.perf_counter()
+        build_tree_heap(list(forest))
+        times[size] = (sorted_time, time.perf_counter() - start)
+    return times
+
+def benchmark_decoding(data):
+    """
+    Decodes the Huffman code of data with the bit by bit loops of
+    huffman_decoding and decode_packed, and with TableDecoder.
+    
+    Returns a dict that maps the decoder to its throughput in MB/s of
+    decoded data.
+    """
+    size = len(data.encode("utf-8")) / 10 ** 6
+    code, tree = huffman_encoding(data)
+    packed = encode_data_packed(data, tree)
+    tableDecoder = TableDecoder(map_char_to_int(None, tree))
+    decoders = {
+        "huffman_decoding": lambda: huffman_decoding(code, tree),
+        "decode_packed": lambda: decode_packed(packed, tree),
+        "TableDecoder": lambda: tableDecoder.decode(packed.data, packed.bit_length),
+    }
+    throughput = {}
+    for name, decoder in decoders.items():
+        start = time.perf_counter()
+        assert(decoder() == data)
+        throughput[name] = size / (time.perf_counter() - start)
+    return throughput
+
+def benchmark_frequencies(size_mb):
+    """
+    Counts the letters of size_mb MB of random bytes with the original
+    loop over the text, with count_frequencies on the text, and with
+    count_frequencies on the bytes.
+    
+    Returns a dict that maps the method to its time in seconds.
+    """
+    rng = random.Random(0)
+    data = bytes(rng.getrandbits(8) for _ in range(10 ** 6)) * size_mb
+    text = data.decode("latin-1")
+    methods = {
+        "loop (str)": lambda: count_frequencies_loop(text),
+        "count_frequencies (str)": lambda: count_frequencies(text),
+        "count_frequencies (bytes)": lambda: count_frequencies(data),
+    }
+    times = {}
+    for name, method in methods.items():
+        start = time.perf_counter()
+        method()
+        times[name] = time.perf_counter() - start
+    return times
+
 #%% [markdown]
 # # Tests
+# Every test is behind an `if __name__ == "__main__":` guard, so that the worker processes of the parallel compression don't run the tests again, see above.
 
 #%%
 # Test the huffman encoding and decoding
 # Input: "go go gophers"
 # Output: expect to see most frequent letters ('g', 'o') closer 
 # to the root of the tree than the rest of the letters
-sentence = "go go gophers"
-code, tree = huffman_encoding(sentence)
+if __name__ == "__main__":
+    sentence = "go go gophers"
+    code, tree = huffman_encoding(sentence)
+
+    print(tree)
+    print(code)
+
+    # Expected output: "go go gophers"
+    print(huffman_decoding(code, tree))
 
-print(tree)
-print(code)
 
-# Expected output: "go go gophers"
-print(huffman_decoding(code, tree))
+#%%
+# Test that both ways to build the tree give the same codes
+# Expected output: True
+if __name__ == "__main__":
+    forest = get_forest("The bird is the word")
+    print(map_char_to_binary(None, build_tree_sorted(list(forest))) ==
+          map_char_to_binary(None, build_tree_heap(list(forest))))
+
+
+#%%
+# Benchmark both ways to build the tree for alphabets with 256 to
+# 65536 letters
+# Expected output: the time of build_tree_heap grows about linearly,
+# the time of build_tree_sorted much faster (it is skipped for the
+# largest alphabets)
+if __name__ == "__main__":
+    for size, (sorted_time, heap_time) in benchmark_build_tree([256, 1024, 4096, 16384, 65536]).items():
+        if sorted_time is None:
+            print(size, "letters: sorted: skipped, heap:", round(heap_time, 4), "s")
+        else:
+            print(size, "letters: sorted:", round(sorted_time, 4), "s, heap:", round(heap_time, 4), "s")
+
+
+#%%
+# Test the packed encoding
+# Input: "go go gophers"
+# Expected output: the same bits as the string code in 5 bytes, and the
+# decoded sentence
+# True
+# 37 bits in 5 bytes
+# go go gophers
+if __name__ == "__main__":
+    sentence = "go go gophers"
+    code, tree = huffman_encoding(sentence)
+    packed, tree = huffman_encoding(sentence, packed=True)
+    print(str(packed) == code)
+    print(len(packed), "bits in", len(packed.data), "bytes")
+    print(huffman_decoding(packed, tree))
+
+
+#%%
+# Decode 1 MB of English-like text with all decoders
+# Expected output: the throughput of each decoder, TableDecoder should
+# be several times faster than the bit by bit loops
+if __name__ == "__main__":
+    rng = random.Random(0)
+    words = ["the", "bird", "is", "word", "go", "gophers", "huffman", "tree", "code", "a"]
+    text = " ".join(rng.choice(words) for _ in range(250000))[:10 ** 6]
+    for name, mb_per_s in benchmark_decoding(text).items():
+        print(name + ":", round(mb_per_s, 2), "MB/s")
+
+
+#%%
+# Compress a sentence to a file and decompress it from the file
+# Input: "The bird is the word"
+# Expected output: the sizes and the decompressed sentence
+# code lengths equal: True
+# compressed: 73 bytes (most of it is the header of 12 letters)
+# The bird is the word
+if __name__ == "__main__":
+    import os
+    import tempfile
+
+    sentence = "The bird is the word"
+    _, tree = huffman_encoding(sentence)
+    blob = huffman_compress(sentence)
+    lengths = {letter: length for letter, (_, length) in
+               canonical_codes(get_code_lengths(tree)).items()}
+    print("code lengths equal:", lengths == get_code_lengths(tree))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "sentence.huf")
+        with open(path, "wb") as f:
+            f.write(blob)
+        with open(path, "rb") as f:
+            blob = f.read()
+    print("compressed:", len(blob), "bytes")
+    print(huffman_decompress(blob))
+
+
+#%%
+# Compress and decompress a binary stream in chunks of 1000 bytes, with
+# a first pass over all data and with a sample of the first 100 bytes
+# Input: 10000 random bytes with mostly small values
+# Expected output: the same data after compressing and decompressing
+# True True
+# True True
+if __name__ == "__main__":
+    import io
+
+    rng = random.Random(0)
+    data = bytes(min(255, int(rng.expovariate(0.1))) for _ in range(10000))
+    for sample_size in [None, 100]:
+        compressed = io.BytesIO()
+        huffman_encode_stream(io.BytesIO(data), compressed, chunk_size=1000,
+                              sample_size=sample_size)
+        compressed.seek(0)
+        decompressed = io.BytesIO()
+        size = huffman_decode_stream(compressed, decompressed)
+        print(decompressed.getvalue() == data, len(compressed.getvalue()) < len(data))
+
+
+#%%
+# Count the letters of 10 MB of data with all methods. Use
+# benchmark_frequencies(100) for 100 MB, which takes about 10 times
+# longer.
+# Expected output: the time of every method. Without NumPy, counting the
+# bytes with collections.Counter is about 2 times faster than the loop.
+# With NumPy installed, numpy.bincount counts them without any Python
+# level loop and is much faster. Then True for every check.
+if __name__ == "__main__":
+    times = benchmark_frequencies(10)
+    for name, seconds in times.items():
+        print(name + ":", round(seconds, 3), "s, speedup:",
+              round(times["loop (str)"] / seconds, 1))
+
+    # Bytes and text give the same frequencies, also for a memoryview that
+    # skips every second byte
+    print(count_frequencies(b"go go gophers") == count_frequencies("go go gophers"))
+    print(count_frequencies(memoryview(b"gxoxpxhxexrxsx")[::2]) ==
+          count_frequencies("gophers"))
+
+    # NumPy and collections.Counter give the same frequencies
+    if numpy is not None:
+        data = bytes(random.Random(1).randrange(256) for _ in range(100000))
+        withNumpy = count_byte_frequencies(data)
+        numpy, savedNumpy = None, numpy
+        try:
+            withCounter = count_byte_frequencies(data)
+        finally:
+            numpy = savedNumpy
+        print(withNumpy == withCounter)
+    else:
+        print("NumPy is not installed, only collections.Counter is used")
+
+
+#%%
+# Compress 400 KB in blocks of 50 KB with shared and with per block codes,
+# decompress everything, and then only block 3
+# Input: text of random words
+# Expected output: the same data for every check, and the compression
+# ratio
+# shared table: True True ratio: 0.49
+# per block tables: True True ratio: 0.49
+if __name__ == "__main__":
+    rng = random.Random(1)
+    words = ["the", "bird", "is", "word", "go", "gophers", "huffman", "tree", "code", "a"]
+    data = " ".join(rng.choice(words) for _ in range(100000)).encode("latin-1")[:400000]
+    for name, shared_table in [("shared table", True), ("per block tables", False)]:
+        blob = huffman_compress_parallel(data, block_size=50000, max_workers=4,
+                                         shared_table=shared_table)
+        print(name + ":",
+              huffman_decompress_parallel(blob, max_workers=4) == data,
+              huffman_decompress_block(blob, 3) == data[150000:200000],
+              "ratio:", round(len(blob) / len(data), 2))
 
 
 #%%
@@ -275,15 +1067,16 @@ def test(sentence):
 
 #%%
 # Input:  
-test_sentences = ["The bird is the word", 
-                  "Hey, this is Kat. She's the best!",
-                  "kkkk",
-                  "         ",
-                  ""]
-
-# Output: I expect the first two cases to work, and the last one to throw an exception,
-# since I defined that an emtpy string is not a valid input.
-for sentence in test_sentences:
-    test(sentence)
+if __name__ == "__main__":
+    test_sentences = ["The bird is the word", 
+                      "Hey, this is Kat. She's the best!",
+                      "kkkk",
+                      "         ",
+                      ""]
+
+    # Output: I expect the first two cases to work, and the last one to throw an exception,
+    # since I defined that an emtpy string is not a valid input.
+    for sentence in test_sentences:
+        test(sentence)
 
 